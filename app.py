@@ -5,65 +5,632 @@ Created on Sat May 24 17:12:16 2025
 @author: crisv
 """
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
-from dash import Dash, dcc, html, Input, Output, State, callback_context, ALL
-import geopandas as gpd
+from dash import Dash, dcc, html, Input, Output, State, callback_context, ALL, ClientsideFunction, Patch
+from collections import Counter, OrderedDict, namedtuple
 from datetime import datetime
+from flask import Response, abort, g, jsonify, request, send_file
+import glob
+import gzip
+import hashlib
+import hmac
 import json
 import dash
 import os
+import threading
+import time
+import unicodedata
 from dash.exceptions import PreventUpdate
-from shapely.geometry import Polygon
-import base64
+import plotly.io.json
+from PIL import Image, ImageOps, features
+from metricas import Metricas
+from geodatos import IndiceEspacial, IndiceRadio, cargar_geodatos, escribir_atomico, niveles_detalle, ruta_geojson
 
 # 1. Configuración inicial y carga de datos
-shapefile_path = "data/shapefiles/municipio_distrito_y_area_no_municipalizada.shp"
-municipios_gdf = gpd.read_file(shapefile_path)
+# Municipios, ubicaciones AIP y GeoJSON por nivel de detalle ya precalculados
+# (ver preprocesamiento.py); en ejecución no se usan librerías geoespaciales
+municipios_tabla, aip_locations_tabla, geojson_niveles = cargar_geodatos()
 
-# Cargar shapefile de ubicaciones AIP
-aip_locations_path = "data/shapefiles/cobertura_trabajo_aip.shp"
-aip_locations_gdf = gpd.read_file(aip_locations_path)
-
-# Cargar y codificar el logo y la figura de huella
+# Logo y figura de huella del encabezado (se sirven como imágenes cacheables,
+# ver servir_imagen)
 logo_path = "assets/logo.png"
 huella_path = "assets/Figura_huella_aip.png"
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-    return f"data:image/jpeg;base64,{encoded_string}"
+# Motor de filtros: índices construidos una sola vez al cargar los datos.
+# Las columnas categóricas guardan un bitmap por valor y los rangos de año y
+# costo se resuelven con búsqueda binaria sobre arreglos ordenados.
+class MotorFiltros:
+    columnas_categoricas = {
+        'tipos': 'Tipo de proyecto',
+        'departamentos': 'Departamento',
+        'comunidades': 'Comunidad beneficiaria'
+    }
+
+    def __init__(self, frame):
+        self.total_filas = len(frame)
+        self.bitmaps = {}
+        for filtro, columna in self.columnas_categoricas.items():
+            codigos, valores = pd.factorize(frame[columna])
+            self.bitmaps[filtro] = {valor: codigos == i for i, valor in enumerate(valores)}
+        self.municipio_id = frame['municipio_id'].to_numpy()
+        self.rangos = {
+            'anos': self._indice_ordenado(frame['Año inicio'].to_numpy()),
+            'costos': self._indice_ordenado(frame['Costo (millones)'].to_numpy())
+        }
+
+    @staticmethod
+    def _indice_ordenado(valores):
+        orden = np.argsort(valores, kind='stable')
+        return valores[orden], orden
+
+    def _mascara_rango(self, filtro, minimo, maximo):
+        valores, orden = self.rangos[filtro]
+        inicio = np.searchsorted(valores, minimo, side='left')
+        fin = np.searchsorted(valores, maximo, side='right')
+        mascara = np.zeros(self.total_filas, dtype=bool)
+        mascara[orden[inicio:fin]] = True
+        return mascara
+
+    def mascara_categorias(self, filtros):
+        mascara = np.ones(self.total_filas, dtype=bool)
+        for filtro, bitmaps in self.bitmaps.items():
+            seleccion = filtros.get(filtro)
+            if seleccion:
+                union = np.zeros(self.total_filas, dtype=bool)
+                for valor in seleccion:
+                    if valor in bitmaps:
+                        union |= bitmaps[valor]
+                mascara &= union
+        # Filtro espacial: filas de municipios dentro de la región dibujada en el mapa
+        if filtros.get('municipios') is not None:
+            mascara &= np.isin(self.municipio_id, filtros['municipios'])
+        return mascara
 
-logo_encoded = encode_image(logo_path) if os.path.exists(logo_path) else None
-huella_encoded = encode_image(huella_path) if os.path.exists(huella_path) else None
+    def filtrar(self, filtros):
+        mascara = self.mascara_categorias(filtros)
+        mascara &= self._mascara_rango('anos', *filtros['anos'])
+        mascara &= self._mascara_rango('costos', *filtros['costos'])
+        return np.flatnonzero(mascara)
 
-if municipios_gdf.crs != "EPSG:4326":
-    municipios_gdf = municipios_gdf.to_crs("EPSG:4326")
-if aip_locations_gdf.crs != "EPSG:4326":
-    aip_locations_gdf = aip_locations_gdf.to_crs("EPSG:4326")
+# Paso del slider de costos (millones de $COP); también define los intervalos
+# del preagregado que usa el navegador para los KPIs mientras se arrastra
+paso_costos = 50
 
-municipios_gdf_projected = municipios_gdf.to_crs("EPSG:3116")
-municipios_gdf_projected['centroid'] = municipios_gdf_projected.geometry.centroid
-municipios_gdf['lon'] = municipios_gdf_projected.centroid.map(lambda p: p.x)
-municipios_gdf['lat'] = municipios_gdf_projected.centroid.map(lambda p: p.y)
+datos_path = "data/proyectos.xlsx"
 
-def cargar_base_datos():
-    df = pd.read_excel("data/proyectos.xlsx")
+def version_archivo(path):
+    estado = os.stat(path)
+    return f"{estado.st_mtime_ns:x}-{estado.st_size:x}"
+
+def leer_excel_proyectos():
+    return preparar_proyectos(pd.read_excel(datos_path))
+
+def preparar_proyectos(df):
     df['Fecha inicio'] = pd.to_datetime(df['Fecha inicio'])
     df['Fecha fin'] = pd.to_datetime(df['Fecha fin'])
+
+    # Filas incompletas: sin ID o sin fecha de inicio no pueden filtrarse ni
+    # seleccionarse y se descartan; los beneficiarios en blanco cuentan como 0
+    incompletos = df['ID'].isna() | df['Fecha inicio'].isna()
+    if incompletos.any():
+        print(f"{incompletos.sum()} proyectos sin ID o sin fecha de inicio descartados "
+              f"(filas {', '.join(str(fila + 2) for fila in np.flatnonzero(incompletos))} del Excel)")
+        df = df[~incompletos].reset_index(drop=True)
+    for columna in ['Beneficiarios directos', 'Beneficiarios indirectos']:
+        vacios = df[columna].isna()
+        if vacios.any():
+            print(f"{vacios.sum()} proyectos sin '{columna}' se cuentan con 0: ID {', '.join(str(int(i)) for i in df.loc[vacios, 'ID'])}")
+            df[columna] = df[columna].fillna(0)
     df['Beneficiarios totales'] = df['Beneficiarios directos'] + df['Beneficiarios indirectos']
     
     # Normalizar nombres de municipios y departamentos para coincidencia exacta
     df['Municipio'] = df['Municipio'].str.upper().str.strip()
     df['Departamento'] = df['Departamento'].str.upper().str.strip()
-    municipios_gdf['MpNombre'] = municipios_gdf['MpNombre'].str.upper().str.strip()
-    municipios_gdf['Depto'] = municipios_gdf['Depto'].str.upper().str.strip()
     
+    # Municipio o departamento en blanco: el proyecto se conserva con un nombre
+    # de reemplazo y queda como municipio sin coincidencia
+    for columna, reemplazo in (('Municipio', 'SIN MUNICIPIO'), ('Departamento', 'SIN DEPARTAMENTO')):
+        vacios = df[columna].isna() | (df[columna] == '')
+        if vacios.any():
+            print(f"{vacios.sum()} proyectos sin '{columna}' quedan como {reemplazo}: ID {', '.join(str(int(i)) for i in df.loc[vacios, 'ID'])}")
+            df.loc[vacios, columna] = reemplazo
+    
+    return compactar_tipos(df)
+
+# Tipos compactos: categorías para los textos repetidos, int16 para el año de
+# inicio y float32/int32 para las medidas. El año de fin queda en float32
+# porque hay proyectos sin fecha de fin. El costo total se mantiene en int64
+# porque supera el rango de int32 (hay proyectos de varios miles de millones).
+columnas_categoricas = ['Municipio', 'Departamento', 'Tipo de proyecto', 'Comunidad beneficiaria', 'Entidad financiadora']
+columnas_int32 = ['ID', 'Beneficiarios directos', 'Beneficiarios indirectos', 'Beneficiarios totales']
+columnas_float32 = ['Área intervenida (ha)', 'Duración del proyecto (meses)']
+
+def compactar_tipos(df):
+    df['Año inicio'] = df['Fecha inicio'].dt.year.astype('int16')
+    df['Año fin'] = df['Fecha fin'].dt.year.astype('float32')
+    for columna in columnas_categoricas:
+        df[columna] = df[columna].astype('category')
+    for columna in columnas_int32:
+        df[columna] = df[columna].astype('int32')
+    for columna in columnas_float32:
+        df[columna] = df[columna].astype('float32')
+    return df
+
+# Copia columnar (.npz) de la base ya procesada, una por versión del Excel:
+# evita volver a parsear el archivo con openpyxl en cada arranque
+proyectos_cache_dir = "cache/proyectos"
+
+def guardar_columnar(df, path):
+    arreglos, esquema = {}, []
+    for i, columna in enumerate(df.columns):
+        serie = df[columna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            arreglos[f"c{i}"] = serie.cat.codes.to_numpy()
+            arreglos[f"c{i}_categorias"] = serie.cat.categories.to_numpy(dtype=str)
+            esquema.append([columna, 'categoria'])
+        elif pd.api.types.is_datetime64_any_dtype(serie):
+            arreglos[f"c{i}"] = serie.to_numpy(dtype='datetime64[ns]').view('int64')
+            esquema.append([columna, 'fecha'])
+        elif serie.dtype == object:
+            arreglos[f"c{i}"] = serie.fillna('').to_numpy(dtype=str)
+            arreglos[f"c{i}_nulos"] = serie.isna().to_numpy()
+            esquema.append([columna, 'texto'])
+        else:
+            arreglos[f"c{i}"] = serie.to_numpy()
+            esquema.append([columna, 'numero'])
+    arreglos['esquema'] = np.array(json.dumps(esquema, ensure_ascii=False))
+    escribir_atomico(path, lambda temporal: np.savez(temporal, **arreglos))
+
+def leer_columnar(path):
+    columnas = {}
+    with np.load(path) as datos:
+        for i, (columna, tipo) in enumerate(json.loads(str(datos['esquema']))):
+            valores = datos[f"c{i}"]
+            if tipo == 'categoria':
+                columnas[columna] = pd.Categorical.from_codes(valores, categories=datos[f"c{i}_categorias"].astype(object))
+            elif tipo == 'fecha':
+                columnas[columna] = valores.view('datetime64[ns]')
+            elif tipo == 'texto':
+                columnas[columna] = pd.Series(valores.astype(object)).mask(datos[f"c{i}_nulos"])
+            else:
+                columnas[columna] = valores
+    return pd.DataFrame(columnas)
+
+# Columnas derivadas que dependen del artefacto geográfico; se calculan en cada
+# carga (no se guardan en la copia columnar) porque el shapefile puede cambiar
+# sin que cambie el Excel
+def plegar_texto(texto):
+    # Mayúsculas sin tildes ni espacios repetidos: "Bolívar" y "BOLIVAR " coinciden
+    descompuesto = unicodedata.normalize('NFKD', str(texto))
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.upper().split())
+
+# Índice de municipios construido al arrancar: (municipio, departamento)
+# plegados -> ficha con la fila del artefacto, código, límites, centroide y la
+# vista del mapa (centro y zoom) para enfocarlo. El zoom se calcula a partir de
+# la extensión en metros (EPSG:3116) para que el municipio quepa en el mapa.
+FichaMunicipio = namedtuple('FichaMunicipio', ['fila', 'codigo', 'nombre', 'depto', 'limites', 'centroide', 'vista'])
+
+def vista_municipio(limites, ancho_m, alto_m):
+    minx, miny, maxx, maxy = limites
+    lat = (miny + maxy) / 2
+    # Metros por píxel en Mapbox: 78271.517 * cos(lat) / 2^zoom; se deja un
+    # margen del 20 % alrededor del municipio en un mapa de unos 500 px
+    extension = max(ancho_m, alto_m, 1000) * 1.2
+    zoom = np.log2(78271.517 * np.cos(np.radians(lat)) * 500 / extension)
+    return {'lat': lat, 'lon': (minx + maxx) / 2, 'zoom': round(float(np.clip(zoom, 6, 12)), 2)}
+
+fichas_municipios = [
+    FichaMunicipio(
+        fila, fila_tabla.MpCodigo, fila_tabla.MpNombre, fila_tabla.Depto,
+        (fila_tabla.minx, fila_tabla.miny, fila_tabla.maxx, fila_tabla.maxy),
+        (fila_tabla.lon, fila_tabla.lat),
+        vista_municipio((fila_tabla.minx, fila_tabla.miny, fila_tabla.maxx, fila_tabla.maxy),
+                        fila_tabla.ancho_m, fila_tabla.alto_m)
+    )
+    for fila, fila_tabla in enumerate(municipios_tabla.itertuples(index=False))
+]
+indice_municipios = {
+    (plegar_texto(ficha.nombre), plegar_texto(ficha.depto)): ficha for ficha in fichas_municipios
+}
+
+def buscar_municipio(municipio, departamento):
+    return indice_municipios.get((plegar_texto(municipio), plegar_texto(departamento)))
+
+# Índice espacial de los polígonos (para clics sin municipio asociado y
+# selecciones sobre el mapa) y puntos AIP por municipio, a partir del join
+# espacial hecho al preprocesar
+indice_espacial = IndiceEspacial(municipios_tabla['MpCodigo'])
+aip_municipio_id = aip_locations_tabla['municipio_id'].to_numpy()
+aip_por_municipio = np.bincount(aip_municipio_id[aip_municipio_id >= 0], minlength=len(municipios_tabla))
+
+# Búsqueda por radio: rejillas sobre los centroides de municipios y los puntos
+# AIP en coordenadas planas (EPSG:3116, metros)
+indice_radio_municipios = IndiceRadio(municipios_tabla['x'], municipios_tabla['y'])
+indice_radio_aip = IndiceRadio(aip_locations_tabla['x'], aip_locations_tabla['y'])
+
+def centro_de_click(point):
+    # Centro de la búsqueda: el punto AIP pulsado o el centroide del municipio
+    if 'location' not in point and len(point.get('customdata') or []) > 2 and 'pointIndex' in point:
+        fila = aip_locations_tabla.iloc[point['pointIndex']]
+        return fila['x'], fila['y']
+    municipio_id = municipio_de_click(point)
+    if municipio_id is None:
+        return None
+    return municipios_tabla['x'].iat[municipio_id], municipios_tabla['y'].iat[municipio_id]
+
+def municipio_de_click(point):
+    # Polígonos: código DANE en 'location'; puntos AIP: fila del municipio que
+    # los contiene en customdata (en los polígonos customdata[2] es el tipo de
+    # proyecto); en otro caso se busca la coordenada
+    if str(point.get('location')) in indice_espacial.filas_por_codigo:
+        return indice_espacial.filas_por_codigo[str(point['location'])]
+    customdata = point.get('customdata') or []
+    if len(customdata) == 3 and isinstance(customdata[2], (int, float)) and customdata[2] >= 0:
+        return int(customdata[2])
+    if 'lon' in point and 'lat' in point:
+        return indice_espacial.municipio_en(point['lon'], point['lat'])
+    return None
+
+def derivar_columnas(df):
+    df['Costo (millones)'] = df['Costo total ($COP)'] / 1000000
+    
+    # Llave entera del municipio (fila de municipios_tabla, -1 si no coincide),
+    # resuelta una vez por par distinto municipio/departamento
+    pares = df[['Municipio', 'Departamento']].drop_duplicates()
+    fichas = {
+        (municipio, departamento): buscar_municipio(municipio, departamento)
+        for municipio, departamento in zip(pares['Municipio'], pares['Departamento'])
+    }
+    llaves = {par: ficha.fila if ficha else -1 for par, ficha in fichas.items()}
+    df['municipio_id'] = np.fromiter(
+        (llaves[par] for par in zip(df['Municipio'], df['Departamento'])), dtype=np.int32, count=len(df)
+    )
+    
+    # Orden por texto: una copia columnar anterior puede traer celdas vacías (NaN)
+    sin_coincidencia = sorted((par for par, fila in llaves.items() if fila < 0), key=lambda par: tuple(map(str, par)))
+    if sin_coincidencia:
+        print(f"{len(sin_coincidencia)} municipios sin coincidencia en el shapefile: "
+              f"{', '.join(f'{municipio} ({departamento})' for municipio, departamento in sin_coincidencia)}")
+    
+    # Clave de cada municipio en tarjetas, selección y mapa: su fila en el
+    # artefacto o, sin coincidencia, un negativo propio por par
+    # municipio/departamento. La etiqueta lleva el departamento cuando hay
+    # municipios homónimos ("EL TAMBO (CAUCA)", "EL TAMBO (NARIÑO)")
+    claves = {**{par: fila for par, fila in llaves.items() if fila >= 0},
+              **{par: -1 - i for i, par in enumerate(sin_coincidencia)}}
+    pares_por_clave = {}
+    for par in sorted(claves, key=lambda par: tuple(map(str, par))):
+        pares_por_clave.setdefault(claves[par], par)
+    homonimos = Counter(municipio for municipio, _ in pares_por_clave.values())
+    etiquetas = {
+        clave: f"{municipio}" if homonimos[municipio] == 1 else f"{municipio} ({departamento})"
+        for clave, (municipio, departamento) in pares_por_clave.items()
+    }
+    df['municipio_clave'] = np.fromiter(
+        (claves[par] for par in zip(df['Municipio'], df['Departamento'])), dtype=np.int32, count=len(df)
+    )
+    df['Municipio (etiqueta)'] = df['municipio_clave'].map(etiquetas).astype('category')
     return df
 
-df = cargar_base_datos()
+def cargar_base_datos(version):
+    cache_path = os.path.join(proyectos_cache_dir, f"proyectos-{version}.npz")
+    if os.path.exists(cache_path):
+        df = leer_columnar(cache_path)
+    else:
+        df = leer_excel_proyectos()
+        guardar_columnar(df, cache_path)
+        for anterior in glob.glob(os.path.join(proyectos_cache_dir, "proyectos-*.npz")):
+            if anterior != cache_path:
+                os.remove(anterior)
+    
+    df = derivar_columnas(df)
+    return df, MotorFiltros(df)
+
+# Gestor de versiones de la base de proyectos: detecta cambios en el archivo
+# (sondeo periódico o endpoint de recarga), reconstruye el DataFrame y sus
+# índices en segundo plano y los reemplaza de forma atómica. Cada callback toma
+# una sola instantánea al empezar, así que trabaja con datos consistentes
+# aunque haya una recarga en curso.
+DatosProyectos = namedtuple('DatosProyectos', ['df', 'motor', 'version', 'actualizado'])
+
+class GestorDatos:
+    def __init__(self, path, intervalo=30):
+        self.path = path
+        self.intervalo = intervalo
+        self.lock = threading.Lock()
+        self.actual = self._cargar()
+
+    def _cargar(self):
+        version = version_archivo(self.path)
+        df, motor = cargar_base_datos(version)
+        return DatosProyectos(df, motor, version, datetime.fromtimestamp(os.path.getmtime(self.path)))
+
+    def recargar_si_cambio(self):
+        with self.lock:
+            if version_archivo(self.path) == self.actual.version:
+                return False
+            self.actual = self._cargar()
+            print(f"Base de proyectos recargada (versión {self.actual.version})")
+            return True
+
+    def _vigilar(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.recargar_si_cambio()
+            except Exception as error:
+                print(f"No se pudo recargar {self.path}: {error}")
+
+    def iniciar_vigilancia(self):
+        # Con intervalo 0 no hay sondeo (solo el endpoint de recarga)
+        if self.intervalo <= 0:
+            return
+        threading.Thread(target=self._vigilar, name='vigilancia-datos', daemon=True).start()
+
+gestor_datos = GestorDatos(datos_path, intervalo=int(os.environ.get('DASHBOARD_INTERVALO_RECARGA', '30')))
+gestor_datos.iniciar_vigilancia()
+
+# GeoJSON de municipios precalculado: el navegador lo descarga una sola vez y
+# las figuras solo lo referencian por URL mediante 'locations'/'featureidkey'.
+# El nivel de detalle se elige según el zoom del mapa.
+def url_geojson_municipios(zoom):
+    nivel = [n for n in niveles_detalle if zoom >= n['zoom_min']][-1]['nombre']
+    etag = geojson_niveles[nivel]
+    return f"/geodatos/municipios-{nivel}.geojson?v={etag[:12]}"
+
 app = Dash(__name__, title="Dashboard de Proyectos Fundación AIP", suppress_callback_exceptions=True)
 
+@app.server.route('/geodatos/municipios-<nivel>.geojson')
+def servir_geojson_municipios(nivel):
+    if nivel not in geojson_niveles:
+        abort(404)
+    return send_file(os.path.abspath(ruta_geojson(nivel)), mimetype='application/geo+json',
+                     conditional=True, etag=geojson_niveles[nivel], max_age=31536000)
+
+# Compresión de las respuestas de callbacks y del layout por encima de un
+# umbral: brotli si está instalado y el navegador lo acepta, si no gzip. Se
+# registra antes que las métricas para que estas midan el tamaño sin comprimir
+# (Flask ejecuta los after_request en orden inverso).
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Con orjson instalado las figuras (arreglos de numpy incluidos) se
+# serializan con él en lugar del codificador json estándar
+try:
+    import orjson
+    plotly.io.json.config.default_engine = 'orjson'
+except ImportError:
+    pass
+
+rutas_comprimibles = ('/_dash-update-component', '/_dash-layout', '/_dash-dependencies')
+umbral_compresion = int(os.environ.get('DASHBOARD_UMBRAL_COMPRESION', '1024'))
+registro_compresion = os.environ.get('DASHBOARD_REGISTRO_COMPRESION', '') == '1'
+
+@app.server.after_request
+def comprimir_respuesta(response):
+    if (not request.path.endswith(rutas_comprimibles) or response.direct_passthrough or
+            response.status_code != 200 or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    datos = response.get_data()
+    if len(datos) < umbral_compresion:
+        return response
+    
+    if brotli is not None and request.accept_encodings['br']:
+        codificacion, comprimido = 'br', brotli.compress(datos, quality=5)
+    elif request.accept_encodings['gzip']:
+        codificacion, comprimido = 'gzip', gzip.compress(datos, compresslevel=6)
+    else:
+        return response
+    
+    response.set_data(comprimido)
+    response.headers['Content-Encoding'] = codificacion
+    if registro_compresion:
+        print(f"{request.path}: {len(datos):,} -> {len(comprimido):,} bytes "
+              f"({len(comprimido) / len(datos):.1%}, {codificacion})")
+    return response
+
+# Métricas por callback en formato Prometheus (ver metricas.py): se mide cada
+# petición a /_dash-update-component y se identifica el callback por su salida
+metricas = Metricas()
+
+def nombre_disparador(prop_id):
+    # Los ids de pattern-matching se agrupan por tipo para acotar las etiquetas
+    componente, _, propiedad = prop_id.rpartition('.')
+    if componente.startswith('{'):
+        try:
+            componente = f"{json.loads(componente).get('type', 'patron')}[ALL]"
+        except ValueError:
+            componente = 'patron'
+    return f"{componente}.{propiedad}"
+
+@app.server.before_request
+def iniciar_medicion():
+    if request.path.endswith('/_dash-update-component'):
+        g.inicio_callback = time.perf_counter()
+
+@app.server.after_request
+def registrar_medicion(response):
+    inicio = g.pop('inicio_callback', None)
+    if inicio is not None:
+        cuerpo = request.get_json(silent=True) or {}
+        salida = cuerpo.get('output', '')
+        callback = app.callback_map.get(salida, {}).get('callback')
+        cambiados = cuerpo.get('changedPropIds') or []
+        metricas.registrar_llamada(
+            getattr(callback, '__name__', salida),
+            nombre_disparador(cambiados[0]) if cambiados else 'inicial',
+            time.perf_counter() - inicio,
+            response.calculate_content_length() or 0,
+            error=response.status_code >= 500
+        )
+    return response
+
+@app.server.route('/metrics')
+def servir_metricas():
+    return Response(metricas.texto_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Recarga inmediata de la base de proyectos (además del sondeo periódico).
+# Solo está habilitada si se define DASHBOARD_TOKEN_RECARGA.
+@app.server.route('/admin/recargar-datos', methods=['POST'])
+def recargar_datos():
+    token = os.environ.get('DASHBOARD_TOKEN_RECARGA')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('X-Token-Recarga', ''), token):
+        abort(403)
+    recargado = gestor_datos.recargar_si_cambio()
+    return jsonify({'recargado': recargado, 'version': gestor_datos.actual.version})
+
+# Fotografías de los proyectos: los callbacks solo intercambian URLs y el
+# navegador descarga cada archivo una vez (ETag, Range y caché de larga duración).
+# De cada foto se generan variantes (miniatura, pantalla y original) en JPEG
+# progresivo y WebP, guardadas en disco con el hash del contenido como clave y
+# regeneradas de forma perezosa cuando cambia el archivo fuente.
+fotos_dir = "assets/fotos"
+cache_fotos_dir = "cache/fotos"
+webp_disponible = features.check('webp')
+variantes_foto = {
+    'miniatura': 320,
+    'pantalla': 1600,
+    'original': None
+}
+hashes_fotos = {}
+
+def ruta_foto(proyecto, numero):
+    for extension in ('jpg', 'JPG', 'jpeg', 'JPEG'):
+        foto_path = os.path.join(fotos_dir, f"Rf {numero} proyecto {proyecto}.{extension}")
+        if os.path.exists(foto_path):
+            return foto_path
+    return None
+
+def hash_foto(foto_path):
+    estado = os.stat(foto_path)
+    firma = (estado.st_mtime_ns, estado.st_size)
+    guardado = hashes_fotos.get(foto_path)
+    if guardado and guardado[0] == firma:
+        return guardado[1]
+    with open(foto_path, "rb") as image_file:
+        digest = hashlib.sha1(image_file.read()).hexdigest()
+    hashes_fotos[foto_path] = (firma, digest)
+    return digest
+
+# Un cerrojo por archivo de destino: si varios hilos piden la misma variante
+# aún no generada, uno la genera y los demás la encuentran hecha
+locks_derivados = {}
+lock_derivados = threading.Lock()
+
+def derivado_imagen(origen, lado, variante, formato):
+    # El prefijo identifica el archivo fuente para borrar las variantes de sus
+    # versiones anteriores, como las copias proyectos-*.npz de la base
+    prefijo = hashlib.sha1(os.path.abspath(origen).encode('utf-8')).hexdigest()[:12]
+    digest = hash_foto(origen)
+    destino = os.path.join(cache_fotos_dir, f"{prefijo}-{digest}-{variante}.{formato}")
+    if os.path.exists(destino):
+        return destino
+    with lock_derivados:
+        lock = locks_derivados.setdefault(destino, threading.Lock())
+    with lock:
+        if os.path.exists(destino):
+            return destino
+        os.makedirs(cache_fotos_dir, exist_ok=True)
+        with Image.open(origen) as original:
+            imagen = ImageOps.exif_transpose(original)
+            # PNG y WebP conservan la transparencia (logos); JPEG no la admite
+            transparente = 'A' in imagen.getbands() or 'transparency' in imagen.info
+            imagen = imagen.convert('RGBA' if transparente and formato != 'jpg' else 'RGB')
+        if lado:
+            imagen.thumbnail((lado, lado), Image.LANCZOS)
+        # Temporal propio de cada hilo y proceso: otro worker puede estar
+        # generando la misma variante a la vez
+        temporal = f"{destino}.{os.getpid()}-{threading.get_ident()}.tmp"
+        if formato == 'webp':
+            imagen.save(temporal, 'WEBP', quality=80, method=4)
+        elif formato == 'png':
+            imagen.save(temporal, 'PNG', optimize=True)
+        else:
+            imagen.save(temporal, 'JPEG', quality=85, optimize=True, progressive=True)
+        os.replace(temporal, destino)
+    with lock_derivados:
+        locks_derivados.pop(destino, None)
+    
+    for anterior in glob.glob(os.path.join(cache_fotos_dir, f"{prefijo}-*")):
+        if not os.path.basename(anterior).startswith(f"{prefijo}-{digest}-") and not anterior.endswith('.tmp'):
+            try:
+                os.remove(anterior)
+            except OSError:
+                pass
+    return destino
+
+def derivado_foto(foto_path, variante, formato):
+    return derivado_imagen(foto_path, variantes_foto[variante], variante, formato)
+
+def url_foto(proyecto, numero, variante='pantalla'):
+    foto_path = ruta_foto(proyecto, numero)
+    if foto_path is None:
+        return None
+    return f"/fotos/{proyecto}/{numero}/{variante}?v={hash_foto(foto_path)[:12]}"
+
+@app.server.route('/fotos/<int:proyecto>/<int:numero>/<variante>')
+def servir_foto(proyecto, numero, variante):
+    foto_path = ruta_foto(proyecto, numero)
+    if foto_path is None or variante not in variantes_foto:
+        abort(404)
+    acepta_webp = webp_disponible and request.accept_mimetypes['image/webp'] > 0
+    formato = 'webp' if acepta_webp else 'jpg'
+    respuesta = send_file(os.path.abspath(derivado_foto(foto_path, variante, formato)),
+                          mimetype='image/webp' if acepta_webp else 'image/jpeg',
+                          conditional=True, etag=True, max_age=31536000)
+    respuesta.vary.add('Accept')
+    return respuesta
+
+# Imágenes del encabezado: en lugar de incrustarlas en base64 en el layout se
+# sirven reducidas al doble de su tamaño en pantalla (WebP o PNG optimizado,
+# ambos con transparencia) y con la huella del contenido en la URL, así el
+# navegador las guarda en caché y el layout JSON no las incluye
+imagenes_encabezado = {
+    'logo': {'path': logo_path, 'lado': 400},
+    'huella': {'path': huella_path, 'lado': 300}
+}
+
+def url_imagen(nombre):
+    imagen_path = imagenes_encabezado[nombre]['path']
+    if not os.path.exists(imagen_path):
+        return None
+    return f"/imagenes/{nombre}?v={hash_foto(imagen_path)[:12]}"
+
+@app.server.route('/imagenes/<nombre>')
+def servir_imagen(nombre):
+    imagen = imagenes_encabezado.get(nombre)
+    if imagen is None or not os.path.exists(imagen['path']):
+        abort(404)
+    acepta_webp = webp_disponible and request.accept_mimetypes['image/webp'] > 0
+    formato = 'webp' if acepta_webp else 'png'
+    respuesta = send_file(os.path.abspath(derivado_imagen(imagen['path'], imagen['lado'], nombre, formato)),
+                          mimetype=f"image/{formato}",
+                          conditional=True, etag=True, max_age=31536000)
+    respuesta.vary.add('Accept')
+    return respuesta
+
+# Las variantes del encabezado se generan al arrancar el worker: las primeras
+# cargas después de un despliegue ya las encuentran hechas
+def preparar_imagenes_encabezado():
+    for nombre, imagen in imagenes_encabezado.items():
+        if not os.path.exists(imagen['path']):
+            continue
+        for formato in (['webp'] if webp_disponible else []) + ['png']:
+            try:
+                derivado_imagen(imagen['path'], imagen['lado'], nombre, formato)
+            except OSError as error:
+                print(f"No se pudo preparar la imagen {nombre} ({formato}): {error}")
+
+preparar_imagenes_encabezado()
+
 # 2. Esquema de colores mejorado con gamas ordenadas
 colors = {
     'background': '#e8f5e9',
@@ -197,75 +764,6 @@ styles = {
         'boxShadow': '0 4px 12px rgba(0,0,0,0.2)',
         'border': f'1px solid {colors["panel-municipios"]}'
     },
-    'municipio-card': {
-        'padding': '15px',
-        'marginBottom': '12px',
-        'borderRadius': '10px',
-        'backgroundColor': colors['card-bg'],
-        'cursor': 'pointer',
-        'transition': 'all 0.3s ease',
-        'border': f'1px solid {colors["panel-municipios"]}',
-        'boxShadow': '0 3px 6px rgba(0,0,0,0.15)',
-        'display': 'flex',
-        'flexDirection': 'column',
-        'alignItems': 'center',
-        'justifyContent': 'center'
-    },
-    'municipio-card-selected': {
-        'padding': '15px',
-        'marginBottom': '12px',
-        'borderRadius': '10px',
-        'backgroundColor': colors['selected-card-bg'],
-        'color': 'white',
-        'cursor': 'pointer',
-        'border': '3px solid white',
-        'boxShadow': '0 4px 8px rgba(255, 0, 0, 0.6)',
-        'transform': 'scale(1.02)',
-        'display': 'flex',
-        'flexDirection': 'column',
-        'alignItems': 'center',
-        'justifyContent': 'center'
-    },
-    'municipio-name': {
-        'fontWeight': '600',
-        'fontSize': '24px',
-        'marginBottom': '8px',
-        'textAlign': 'center',
-        'color': '#333333',
-        'width': '100%'
-    },
-    'municipio-name-selected': {
-        'fontWeight': '600',
-        'fontSize': '26px',
-        'marginBottom': '8px',
-        'textAlign': 'center',
-        'color': 'white',
-        'width': '100%',
-        'textShadow': '1px 1px 3px rgba(0,0,0,0.7)'
-    },
-    'municipio-projects': {
-        'fontSize': '22px',
-        'fontWeight': '600',
-        'textAlign': 'center',
-        'backgroundColor': '#e6f3ff',
-        'color': colors['panel-municipios'],
-        'padding': '6px 12px',
-        'borderRadius': '18px',
-        'minWidth': '90px',
-        'boxShadow': '0 2px 4px rgba(0,0,0,0.15)'
-    },
-    'municipio-projects-selected': {
-        'fontSize': '22px',
-        'fontWeight': '600',
-        'textAlign': 'center',
-        'backgroundColor': 'rgba(255,255,255,0.3)',
-        'color': 'white',
-        'padding': '6px 12px',
-        'borderRadius': '18px',
-        'minWidth': '90px',
-        'boxShadow': '0 2px 4px rgba(0,0,0,0.3)',
-        'border': '2px solid white'
-    },
     'municipios-title': {
         'textAlign': 'center',
         'color': 'white',
@@ -464,6 +962,14 @@ styles = {
         'boxShadow': '0 2px 4px rgba(0,0,0,0.15)',
         'transition': 'all 0.3s ease'
     },
+    'photo-thumbnail': {
+        'display': 'block',
+        'width': '160px',
+        'height': '120px',
+        'objectFit': 'cover',
+        'borderRadius': '4px',
+        'marginBottom': '6px'
+    },
     'photo-button:hover': {
         'backgroundColor': colors['hover-color'],
         'transform': 'scale(1.05)'
@@ -521,79 +1027,111 @@ styles = {
 }
 
 # 4. Layout de la aplicación
-app.layout = html.Div(style={
-    'backgroundColor': colors['background'],
-    'minHeight': '100vh',
-    'padding': '15px',
-    'margin': '0'
-}, children=[
-    html.Div(style=styles['container'], children=[
-        # Encabezado con título, huella y logo
-        html.Div(style=styles['header-container'], children=[
-            html.Div(
-                html.Div([
-                    html.Span("NUESTRA HUELLA EN COLOMBIA ", style=styles['header']),
+# Se construye en cada carga de página para reflejar la versión vigente de los datos
+def construir_layout():
+    datos = gestor_datos.actual
+    df = datos.df
+    logo_url = url_imagen('logo')
+    huella_url = url_imagen('huella')
+    
+    return html.Div(style={
+        'backgroundColor': colors['background'],
+        'minHeight': '100vh',
+        'padding': '15px',
+        'margin': '0'
+    }, children=[
+        html.Div(style=styles['container'], children=[
+            # Encabezado con título, huella y logo
+            html.Div(style=styles['header-container'], children=[
+                html.Div(
+                    html.Div([
+                        html.Span("NUESTRA HUELLA EN COLOMBIA ", style=styles['header']),
+                        html.Img(
+                            src=huella_url,
+                            alt="Huella de la Fundación AIP en Colombia",
+                            style=styles['huella-img']
+                        ) if huella_url else html.Div()
+                    ], style={
+                        'display': 'flex',
+                        'alignItems': 'center',
+                        'flexWrap': 'wrap'
+                    }),
+                ),
+                html.Div(style=styles['logo-container'], children=[
                     html.Img(
-                        src=huella_encoded,
-                        style=styles['huella-img']
-                    ) if huella_encoded else html.Div()
-                ], style={
-                    'display': 'flex',
-                    'alignItems': 'center',
-                    'flexWrap': 'wrap'
-                }),
-            ),
-            html.Div(style=styles['logo-container'], children=[
-                html.Img(
-                    src=logo_encoded,
-                    style=styles['logo']
-                ) if logo_encoded else html.Div("Logo no encontrado")
-            ])
-        ]),
+                        src=logo_url,
+                        alt="Logo Fundación AIP",
+                        style=styles['logo']
+                    ) if logo_url else html.Div("Logo no encontrado")
+                ])
+            ]),
         
-        # Fila 1: Filtros
-        html.Div(style=styles['filters'], children=[
-            html.Div(style={'display': 'grid', 'gridTemplateColumns': 'repeat(4, 1fr)', 'gap': '15px'}, children=[
-                html.Div([
-                    html.Label("TIPO DE PROYECTO", style=styles['filter-label']),
-                    dcc.Dropdown(
-                        id='tipo-dropdown',
-                        options=[{'label': t, 'value': t} for t in sorted(df['Tipo de proyecto'].unique())],
-                        multi=True,
-                        placeholder="Seleccione tipos...",
-                        style=styles['dropdown']
-                    )
-                ]),
-                html.Div([
-                    html.Label("DEPARTAMENTO", style=styles['filter-label']),
-                    dcc.Dropdown(
-                        id='departamento-dropdown',
-                        options=[{'label': d, 'value': d} for d in sorted(df['Departamento'].unique())],
-                        multi=True,
-                        placeholder="Seleccione departamentos...",
-                        style=styles['dropdown']
-                    )
-                ]),
-                html.Div([
-                    html.Label("COMUNIDAD BENEFICIARIA", style=styles['filter-label']),
-                    dcc.Dropdown(
-                        id='comunidad-dropdown',
-                        options=[{'label': c, 'value': c} for c in sorted(df['Comunidad beneficiaria'].unique())],
-                        multi=True,
-                        placeholder="Seleccione comunidades...",
-                        style=styles['dropdown']
-                    )
+            # Fila 1: Filtros
+            html.Div(style=styles['filters'], children=[
+                html.Div(style={'display': 'grid', 'gridTemplateColumns': 'repeat(4, 1fr)', 'gap': '15px'}, children=[
+                    html.Div([
+                        html.Label("TIPO DE PROYECTO", style=styles['filter-label']),
+                        dcc.Dropdown(
+                            id='tipo-dropdown',
+                            options=[{'label': t, 'value': t} for t in sorted(df['Tipo de proyecto'].unique())],
+                            multi=True,
+                            placeholder="Seleccione tipos...",
+                            style=styles['dropdown']
+                        )
+                    ]),
+                    html.Div([
+                        html.Label("DEPARTAMENTO", style=styles['filter-label']),
+                        dcc.Dropdown(
+                            id='departamento-dropdown',
+                            options=[{'label': d, 'value': d} for d in sorted(df['Departamento'].unique())],
+                            multi=True,
+                            placeholder="Seleccione departamentos...",
+                            style=styles['dropdown']
+                        )
+                    ]),
+                    html.Div([
+                        html.Label("COMUNIDAD BENEFICIARIA", style=styles['filter-label']),
+                        dcc.Dropdown(
+                            id='comunidad-dropdown',
+                            options=[{'label': c, 'value': c} for c in sorted(df['Comunidad beneficiaria'].unique())],
+                            multi=True,
+                            placeholder="Seleccione comunidades...",
+                            style=styles['dropdown']
+                        )
+                    ]),
+                    html.Div([
+                        html.Label("RANGO DE COSTOS (MILLONES $COP)", style=styles['filter-label']),
+                        dcc.RangeSlider(
+                            id='costo-slider',
+                            min=0,
+                            max=7000,
+                            value=[0, 7000],
+                            marks={i: {'label': f"{i}", 'style': {'fontSize': '18px', 'color': colors['text']}} 
+                                   for i in range(0, 7001, 1000)},
+                            step=paso_costos,
+                            tooltip={
+                                "placement": "bottom",
+                                "always_visible": True,
+                                "style": {
+                                    'fontSize': '20px',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['filter-bg']
+                                }
+                            },
+                            updatemode='mouseup'
+                        )
+                    ])
                 ]),
-                html.Div([
-                    html.Label("RANGO DE COSTOS (MILLONES $COP)", style=styles['filter-label']),
+                html.Div(style={'marginTop': '15px'}, children=[
+                    html.Label("RANGO DE AÑOS", style=styles['filter-label']),
                     dcc.RangeSlider(
-                        id='costo-slider',
-                        min=0,
-                        max=7000,
-                        value=[0, 7000],
-                        marks={i: {'label': f"{i}", 'style': {'fontSize': '18px', 'color': colors['text']}} 
-                               for i in range(0, 7001, 1000)},
-                        step=50,
+                        id='year-slider',
+                        min=int(df['Año inicio'].min()),
+                        max=int(df['Año inicio'].max()),
+                        value=[int(df['Año inicio'].min()), int(df['Año inicio'].max())],
+                        marks={str(year): {'label': str(year), 'style': {'fontSize': '18px', 'color': colors['text']}} 
+                               for year in range(int(df['Año inicio'].min()), int(df['Año inicio'].max())+1)},
+                        step=None,
                         tooltip={
                             "placement": "bottom",
                             "always_visible": True,
@@ -603,293 +1141,461 @@ app.layout = html.Div(style={
                                 'backgroundColor': colors['filter-bg']
                             }
                         },
-                        updatemode='drag'
+                        updatemode='mouseup'
+                    )
+                ]),
+                html.Div(style={'marginTop': '15px'}, children=[
+                    html.Label("BÚSQUEDA POR RADIO (KM)", style=styles['filter-label']),
+                    dcc.Checklist(
+                        id='modo-radio',
+                        options=[{'label': ' Fijar el centro con un clic en el mapa', 'value': 'activo'}],
+                        value=[],
+                        style={'fontSize': '18px', 'color': colors['text']}
+                    ),
+                    dcc.Slider(
+                        id='radio-busqueda',
+                        min=5,
+                        max=200,
+                        step=5,
+                        value=30,
+                        marks={i: {'label': f"{i}", 'style': {'fontSize': '18px', 'color': colors['text']}}
+                               for i in [5, 50, 100, 150, 200]},
+                        tooltip={"placement": "bottom", "always_visible": True},
+                        updatemode='mouseup'
                     )
                 ])
             ]),
-            html.Div(style={'marginTop': '15px'}, children=[
-                html.Label("RANGO DE AÑOS", style=styles['filter-label']),
-                dcc.RangeSlider(
-                    id='year-slider',
-                    min=df['Fecha inicio'].dt.year.min(),
-                    max=df['Fecha inicio'].dt.year.max(),
-                    value=[df['Fecha inicio'].dt.year.min(), df['Fecha inicio'].dt.year.max()],
-                    marks={str(year): {'label': str(year), 'style': {'fontSize': '18px', 'color': colors['text']}} 
-                           for year in range(df['Fecha inicio'].dt.year.min(), df['Fecha inicio'].dt.year.max()+1)},
-                    step=None,
-                    tooltip={
-                        "placement": "bottom",
-                        "always_visible": True,
-                        "style": {
-                            'fontSize': '20px',
-                            'color': colors['text'],
-                            'backgroundColor': colors['filter-bg']
-                        }
-                    },
-                    updatemode='drag'
-                )
-            ])
-        ]),
         
-        # Título sección general
-        html.Div("INFORMACIÓN GENERAL DE LOS PROYECTOS", style=styles['section-title']),
+            # Título sección general
+            html.Div("INFORMACIÓN GENERAL DE LOS PROYECTOS", style=styles['section-title']),
         
-        # Fila 2: KPIs con gama ordenada de azules
-        html.Div(style=styles['summary'], children=[
-            html.Div(style={'display': 'grid', 'gridTemplateColumns': 'repeat(4, 1fr)', 'gap': '15px', 'height': '100%'}, children=[
-                html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-1'], 'border':  f'2px solid #00CED1'}, children=[
-                    html.Div("📌 TOTAL PROYECTOS", style=styles['kpi-title']),
-                    html.Div(id='total-proyectos', style=styles['kpi-value'])
-                ]),
-                html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-2'], 'border':  f'2px solid #00CED1'}, children=[
-                    html.Div("💰 INVERSIÓN TOTAL", style=styles['kpi-title']),
-                    html.Div(id='total-inversion', style=styles['kpi-value'])
-                ]),
-                html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-3'], 'border':  f'2px solid #00CED1'}, children=[
-                    html.Div("👥 BENEFICIARIOS", style=styles['kpi-title']),
-                    html.Div(id='total-beneficiarios', style=styles['kpi-value'])
-                ]),
-                html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-4'], 'border':  f'2px solid #00CED1'}, children=[
-                    html.Div("🌿 ÁREA INTERVENIDA", style=styles['kpi-title']),
-                    html.Div(id='total-area', style=styles['kpi-value'])
+            # Fila 2: KPIs con gama ordenada de azules
+            html.Div(style=styles['summary'], children=[
+                html.Div(style={'display': 'grid', 'gridTemplateColumns': 'repeat(4, 1fr)', 'gap': '15px', 'height': '100%'}, children=[
+                    html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-1'], 'border':  f'2px solid #00CED1'}, children=[
+                        html.Div("📌 TOTAL PROYECTOS", style=styles['kpi-title']),
+                        html.Div(id='total-proyectos', style=styles['kpi-value'])
+                    ]),
+                    html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-2'], 'border':  f'2px solid #00CED1'}, children=[
+                        html.Div("💰 INVERSIÓN TOTAL", style=styles['kpi-title']),
+                        html.Div(id='total-inversion', style=styles['kpi-value'])
+                    ]),
+                    html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-3'], 'border':  f'2px solid #00CED1'}, children=[
+                        html.Div("👥 BENEFICIARIOS", style=styles['kpi-title']),
+                        html.Div(id='total-beneficiarios', style=styles['kpi-value'])
+                    ]),
+                    html.Div(style={**styles['card'], 'backgroundColor': colors['panel-azul-4'], 'border':  f'2px solid #00CED1'}, children=[
+                        html.Div("🌿 ÁREA INTERVENIDA", style=styles['kpi-title']),
+                        html.Div(id='total-area', style=styles['kpi-value'])
+                    ])
                 ])
-            ])
-        ]),
-        
-        # Título sección específica
-        html.Div("INFORMACIÓN ESPECÍFICA DE LOS PROYECTOS POR MUNICIPIO", style=styles['section-title']),
-        
-        # Fila 3: Mapa y Lista de Municipios
-        html.Div(style=styles['map-container'], children=[
-            html.Div(id='map-title', children=[
-                "Ubicación Geográfica de los Proyectos por Municipio",
-                html.Span(id='selected-municipio-title', style={'color': colors['map-highlight'], 'marginLeft': '8px', 'fontWeight': '600', 'fontSize': '24px'})
-            ], style={
-                **styles['info-title'],
-                'textAlign': 'center',
-                'padding': '12px',
-                'backgroundColor': colors['panel-especifico'],
-                'marginBottom': '0',
-                'borderRadius': '12px 12px 0 0'
-            }),
-            dcc.Graph(
-                id='mapa', 
-                config={'displayModeBar': False},
-                style={'height': '540px'},
-                clickData=None
-            ),
-            html.Div(id='arrow-1', style=styles['arrow']),
-            html.Div(id='arrow-2', style=styles['arrow']),
-            html.Div(id='arrow-3', style=styles['arrow']),
-            html.Div(id='arrow-4', style=styles['arrow'])
-        ]),
+            ]),
         
-        html.Div(style=styles['municipios-list'], children=[
-            html.Div("MUNICIPIOS CON PROYECTOS", style=styles['municipios-title']),
-            html.Div(id='municipios-cards-container', style={
-                'display': 'grid',
-                'gridTemplateColumns': '1fr',
-                'gap': '12px',
-                'padding': '8px',
-            })
-        ]),
+            # Título sección específica
+            html.Div("INFORMACIÓN ESPECÍFICA DE LOS PROYECTOS POR MUNICIPIO", style=styles['section-title']),
         
-        # Fila 4: Panel de información con gama ordenada de café
-        html.Div(style=styles['info-panel'], children=[
-            html.Div(style={**styles['info-section-specific'], 
-                           'backgroundColor': colors['panel-verde-cana-1'],
-                           'border': f'2px solid {colors["map-highlight"]}'}, 
-                children=[
-                    html.Div("📍 MUNICIPIO SELECCIONADO", style=styles['info-title'], ),
-                    html.Div(id='municipio-value', style={
-                        **styles['info-value'],
-                        'fontSize': '36px',
-                        'color': colors['value-color']
-                    })
-            ]),
-            html.Div(style={**styles['info-section-specific'], 
-                          'backgroundColor': colors['panel-verde-cana-2'],
-                          'border':  f'2px solid #00CED1'}, 
-                children=[
-                   html.Div("🏦 ENTIDAD FINANCIADORA", style=styles['info-title']),
-                   html.Div(id='financiador-value', style={
-                       **styles['info-text'],
-                       'fontSize': '32px'
-                   })
-            ]),
-            html.Div(style={**styles['info-section-specific'], 
-                          'backgroundColor': colors['panel-verde-cana-3'],
-                          'border': f'2px solid #00CED1'}, 
-                children=[
-                    html.Div("⏳ DURACIÓN (MESES)", style=styles['info-title']),
-                    html.Div(id='duracion-value', style={
-                        **styles['info-value'],
-                        'color': colors['value-color']
-                    })
-            ]),
-            html.Div(style={**styles['info-section-specific'], 
-                          'backgroundColor': colors['panel-verde-cana-4'],
-                          'border':  f'2px solid #00CED1'}, 
-                children=[
-                    html.Div("👥 CANTIDAD BENEFICIARIOS", style=styles['info-title']),
-                    html.Div(id='beneficiarios-value', style={
-                        **styles['info-value'],
-                        'color': colors['value-color']
-                    })
+            # Fila 3: Mapa y Lista de Municipios
+            html.Div(style=styles['map-container'], children=[
+                html.Div(id='map-title', children=[
+                    "Ubicación Geográfica de los Proyectos por Municipio",
+                    html.Span(id='selected-municipio-title', style={'color': colors['map-highlight'], 'marginLeft': '8px', 'fontWeight': '600', 'fontSize': '24px'})
+                ], style={
+                    **styles['info-title'],
+                    'textAlign': 'center',
+                    'padding': '12px',
+                    'backgroundColor': colors['panel-especifico'],
+                    'marginBottom': '0',
+                    'borderRadius': '12px 12px 0 0'
+                }),
+                dcc.Graph(
+                    id='mapa', 
+                    config={
+                        'displayModeBar': True,
+                        'displaylogo': False,
+                        'modeBarButtonsToRemove': ['toImage']
+                    },
+                    style={'height': '540px'},
+                    clickData=None
+                ),
+                html.Button(id='limpiar-filtro-espacial', className='filtro-espacial-limpiar', n_clicks=0),
+                html.Div(id='arrow-1', style=styles['arrow']),
+                html.Div(id='arrow-2', style=styles['arrow']),
+                html.Div(id='arrow-3', style=styles['arrow']),
+                html.Div(id='arrow-4', style=styles['arrow'])
             ]),
-            html.Div(style={**styles['info-section-specific'], 
-                          'backgroundColor': colors['panel-verde-cana-5'],
-                          'border':  f'2px solid #00CED1'}, 
-                children=[
-                    html.Div("🌳 HECTÁREAS INTERVENIDAS", style=styles['info-title']),
-                    html.Div(id='area-value', style={
-                        **styles['info-value'],
-                        'color': colors['value-color']
-                    })
+        
+            html.Div(style=styles['municipios-list'], children=[
+                html.Div("MUNICIPIOS CON PROYECTOS", style=styles['municipios-title']),
+                html.Div(id='municipios-cards-container', className='municipios-tarjetas'),
+                html.Div(id='municipios-paginacion', className='municipios-paginacion', children=[
+                    html.Button("‹", id='municipios-anterior', n_clicks=0),
+                    html.Span(id='municipios-pagina-texto'),
+                    html.Button("›", id='municipios-siguiente', n_clicks=0)
+                ])
             ]),
-            html.Div(style={**styles['info-section-specific'], 
-                          'backgroundColor': colors['panel-verde-cana-6'],
-                          'border':  f'2px solid #00CED1'}, 
-                children=[
-                    html.Div("📦 PRODUCTO PRINCIPAL", style=styles['info-title']),
-                    html.Div(id='producto-value', style={
-                        **styles['info-text'],
-                        'fontSize': '32px',
-                        'color': colors['value-color']
-                    })
-            ])
-        ]),
         
-        # Panel para visualización de fotografías
-        html.Div(style=styles['photo-panel'], children=[
-            # Sección izquierda - Selector de proyectos
-            html.Div(style=styles['photo-selector-container'], children=[
-                html.Div("SELECCIONAR UN PROYECTO", style=styles['photo-title']),
-                dcc.Dropdown(
-                    id='proyecto-selector',
-                    style={
-                        'width': '100%',
-                        'borderRadius': '6px',
-                        'border': f'1px solid {colors["border-color"]}',
-                        'fontSize': '20px',
-                        'backgroundColor': 'white',
-                        'color': '#333333'
-                    }
-                )
+            # Fila 4: Panel de información con gama ordenada de café
+            html.Div(style=styles['info-panel'], children=[
+                html.Div(style={**styles['info-section-specific'], 
+                               'backgroundColor': colors['panel-verde-cana-1'],
+                               'border': f'2px solid {colors["map-highlight"]}'}, 
+                    children=[
+                        html.Div("📍 MUNICIPIO SELECCIONADO", style=styles['info-title'], ),
+                        html.Div(id='municipio-value', style={
+                            **styles['info-value'],
+                            'fontSize': '36px',
+                            'color': colors['value-color']
+                        })
+                ]),
+                html.Div(style={**styles['info-section-specific'], 
+                              'backgroundColor': colors['panel-verde-cana-2'],
+                              'border':  f'2px solid #00CED1'}, 
+                    children=[
+                       html.Div("🏦 ENTIDAD FINANCIADORA", style=styles['info-title']),
+                       html.Div(id='financiador-value', style={
+                           **styles['info-text'],
+                           'fontSize': '32px'
+                       })
+                ]),
+                html.Div(style={**styles['info-section-specific'], 
+                              'backgroundColor': colors['panel-verde-cana-3'],
+                              'border': f'2px solid #00CED1'}, 
+                    children=[
+                        html.Div("⏳ DURACIÓN (MESES)", style=styles['info-title']),
+                        html.Div(id='duracion-value', style={
+                            **styles['info-value'],
+                            'color': colors['value-color']
+                        })
+                ]),
+                html.Div(style={**styles['info-section-specific'], 
+                              'backgroundColor': colors['panel-verde-cana-4'],
+                              'border':  f'2px solid #00CED1'}, 
+                    children=[
+                        html.Div("👥 CANTIDAD BENEFICIARIOS", style=styles['info-title']),
+                        html.Div(id='beneficiarios-value', style={
+                            **styles['info-value'],
+                            'color': colors['value-color']
+                        })
+                ]),
+                html.Div(style={**styles['info-section-specific'], 
+                              'backgroundColor': colors['panel-verde-cana-5'],
+                              'border':  f'2px solid #00CED1'}, 
+                    children=[
+                        html.Div("🌳 HECTÁREAS INTERVENIDAS", style=styles['info-title']),
+                        html.Div(id='area-value', style={
+                            **styles['info-value'],
+                            'color': colors['value-color']
+                        })
+                ]),
+                html.Div(style={**styles['info-section-specific'], 
+                              'backgroundColor': colors['panel-verde-cana-6'],
+                              'border':  f'2px solid #00CED1'}, 
+                    children=[
+                        html.Div("📦 PRODUCTO PRINCIPAL", style=styles['info-title']),
+                        html.Div(id='producto-value', style={
+                            **styles['info-text'],
+                            'fontSize': '32px',
+                            'color': colors['value-color']
+                        })
+                ])
             ]),
+        
+            # Panel para visualización de fotografías
+            html.Div(style=styles['photo-panel'], children=[
+                # Sección izquierda - Selector de proyectos
+                html.Div(style=styles['photo-selector-container'], children=[
+                    html.Div("SELECCIONAR UN PROYECTO", style=styles['photo-title']),
+                    dcc.Dropdown(
+                        id='proyecto-selector',
+                        style={
+                            'width': '100%',
+                            'borderRadius': '6px',
+                            'border': f'1px solid {colors["border-color"]}',
+                            'fontSize': '20px',
+                            'backgroundColor': 'white',
+                            'color': '#333333'
+                        }
+                    )
+                ]),
             
-            # Sección derecha - Fotografías
-            html.Div(style=styles['photo-content'], children=[
-                html.Div("EVIDENCIA FOTOGRÁFICA INICIAL Y FINAL DEL PROYECTO", style=styles['photo-title']),
-                html.Div(id='photo-buttons', style=styles['photo-button-container'])
-            ])
-        ]),
+                # Sección derecha - Fotografías
+                html.Div(style=styles['photo-content'], children=[
+                    html.Div("EVIDENCIA FOTOGRÁFICA INICIAL Y FINAL DEL PROYECTO", style=styles['photo-title']),
+                    html.Div(id='photo-buttons', style=styles['photo-button-container'])
+                ])
+            ]),
         
-        # Modal para mostrar las fotografías
-        html.Div(id='photo-modal', style={'display': 'none'}, children=[
-            html.Div(style=styles['modal'], children=[
-                html.Div(style=styles['modal-content'], children=[
-                    html.Img(id='modal-image', style=styles['modal-image']),
-                    html.Button("Cerrar", id='close-modal', style=styles['close-button'])
+            # Modal para mostrar las fotografías
+            html.Div(id='photo-modal', style={'display': 'none'}, children=[
+                html.Div(style=styles['modal'], children=[
+                    html.Div(style=styles['modal-content'], children=[
+                        html.Img(id='modal-image', style=styles['modal-image']),
+                        html.Button("Cerrar", id='close-modal', style=styles['close-button'])
+                    ])
                 ])
-            ])
-        ]),
+            ]),
         
-        # Pie de página
-        html.Div(style={
-            'gridColumn': '1 / span 2',
-            'textAlign': 'center',
-            'color': colors['title-color'],
-            'marginTop': '15px',
-            'fontSize': '20px',
-            'padding': '15px',
-            'borderTop': f'1px solid {colors["title-color"]}'
-        }, children=[
-            html.P("© 2025 Fundación AIP - Todos los derechos reservados"),
-            html.P("Datos actualizados al " + datetime.now().strftime("%d/%m/%Y"))
-        ]),
+            # Pie de página
+            html.Div(style={
+                'gridColumn': '1 / span 2',
+                'textAlign': 'center',
+                'color': colors['title-color'],
+                'marginTop': '15px',
+                'fontSize': '20px',
+                'padding': '15px',
+                'borderTop': f'1px solid {colors["title-color"]}'
+            }, children=[
+                html.P("© 2025 Fundación AIP - Todos los derechos reservados"),
+                html.P("Datos actualizados al " + datos.actualizado.strftime("%d/%m/%Y"))
+            ]),
         
-        # Almacenamiento
-        dcc.Store(id='filtered-data', data=None),
-        dcc.Store(id='selected-municipio', data=None),
-        dcc.Store(id='map-center', data={'lat': 4.6, 'lon': -74.1, 'zoom': 4.5}),
-        dcc.Store(id='photo-store', data=None)
+            # Almacenamiento
+            dcc.Store(id='filtered-data', data=None),
+            dcc.Store(id='selected-municipio', data=None),
+            dcc.Store(id='map-center', data={'lat': 4.6, 'lon': -74.1, 'zoom': 4.5}),
+            dcc.Store(id='photo-store', data=None),
+            dcc.Store(id='kpis-preagregado', data=None),
+            dcc.Store(id='municipios-pagina', data=0),
+            dcc.Store(id='filtro-espacial', data=None)
+        ])
     ])
-])
+
+app.layout = construir_layout
 
 # 5. Funciones de callback (sin cambios)
-def get_municipio_bbox(municipio_name, departamento_name):
-    municipio = municipios_gdf[(municipios_gdf['MpNombre'] == municipio_name.upper().strip()) & 
-                              (municipios_gdf['Depto'] == departamento_name.upper().strip())]
-    if municipio.empty:
-        return None
-    
-    bounds = municipio.geometry.bounds
-    minx, miny, maxx, maxy = bounds.iloc[0]
-    padding = 0.1
-    minx -= padding
-    miny -= padding
-    maxx += padding
-    maxy += padding
-    center_lon = (minx + maxx) / 2
-    center_lat = (miny + maxy) / 2
-    width = maxx - minx
-    height = maxy - miny
-    zoom = 8 - max(width, height) * 5
-    
+# Almacén de resultados en el servidor: el Store 'filtered-data' solo guarda la
+# huella de los filtros (y los filtros normalizados, para poder recalcular el
+# resultado en cualquier worker) en lugar de todas las filas filtradas
+class CacheLRU:
+    def __init__(self, max_entradas=64, ttl=None, max_bytes=None, medir_tamano=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.medir_tamano = medir_tamano
+        self.entradas = OrderedDict()
+        self.total_bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            valor, expira, tamano = entrada
+            if expira is not None and expira < time.monotonic():
+                self._eliminar(clave)
+                self.fallos += 1
+                return None
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        tamano = self.medir_tamano(valor) if self.medir_tamano else 0
+        expira = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            if clave in self.entradas:
+                self._eliminar(clave)
+            self.entradas[clave] = (valor, expira, tamano)
+            self.total_bytes += tamano
+            while self.entradas and (len(self.entradas) > self.max_entradas or
+                                     (self.max_bytes and self.total_bytes > self.max_bytes)):
+                self._eliminar(next(iter(self.entradas)))
+                self.desalojos += 1
+
+    def estadisticas(self):
+        with self.lock:
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'desalojos': self.desalojos,
+                'entradas': len(self.entradas),
+                'bytes': self.total_bytes
+            }
+
+    def limpiar(self):
+        with self.lock:
+            self.entradas.clear()
+            self.total_bytes = 0
+
+    def _eliminar(self, clave):
+        _, _, tamano = self.entradas.pop(clave)
+        self.total_bytes -= tamano
+
+# Tamaño superficial: los textos de las filas filtradas son los mismos objetos
+# que los de la base completa, así que solo se cuentan los arreglos propios
+resultados_filtrados = CacheLRU(
+    max_entradas=64,
+    ttl=15 * 60,
+    max_bytes=256 * 1024 * 1024,
+    medir_tamano=lambda resultado: sum(int(frame.memory_usage().sum()) for frame in resultado)
+)
+
+# Vistas ya calculadas de update_filtered_data (KPIs y figura serializada),
+# indexadas por el estado normalizado de los filtros y la versión de los datos.
+# La figura lleva una fila por proyecto, así que el tope es en bytes: los
+# arreglos numéricos cuentan por nbytes y los de objetos y listas 16 bytes por
+# elemento (el puntero más los objetos propios, como los ID de customdata)
+def tamano_figura(valor):
+    if isinstance(valor, dict):
+        return sum(tamano_figura(v) for v in valor.values())
+    if isinstance(valor, np.ndarray):
+        return valor.size * 16 if valor.dtype == object else valor.nbytes
+    if isinstance(valor, (list, tuple)):
+        if valor and isinstance(valor[0], (dict, list, tuple, np.ndarray)):
+            return sum(tamano_figura(v) for v in valor)
+        return len(valor) * 16
+    if isinstance(valor, str):
+        return len(valor)
+    return 16
+
+vistas_mapa = CacheLRU(
+    max_entradas=256,
+    max_bytes=128 * 1024 * 1024,
+    medir_tamano=lambda vista: tamano_figura(vista['figura'])
+)
+
+metricas.registrar_cache('resultados_filtrados', resultados_filtrados)
+metricas.registrar_cache('vistas_mapa', vistas_mapa)
+
+def normalizar_filtros(tipos, departamentos, comunidades, anos, costos, municipios=None):
     return {
-        'lat': center_lat,
-        'lon': center_lon,
-        'zoom': max(zoom, 10)
+        'tipos': sorted(tipos or []),
+        'departamentos': sorted(departamentos or []),
+        'comunidades': sorted(comunidades or []),
+        'anos': [int(anos[0]), int(anos[1])],
+        'costos': [float(costos[0]), float(costos[1])],
+        'municipios': sorted(int(m) for m in municipios) if municipios is not None else None
     }
 
+def huella_filtros(filtros):
+    return hashlib.sha1(json.dumps(filtros, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# Resultado de un filtro: las filas de proyectos y su agregado por municipio,
+# calculado una sola vez y compartido por las tarjetas, el mapa y los KPIs
+ResultadoFiltro = namedtuple('ResultadoFiltro', ['proyectos', 'municipios'])
+
+def agregar_por_municipio(filtered):
+    # Una sola pasada con bincount sobre la clave del municipio, desplazada
+    # para que las claves negativas (sin coincidencia) queden al principio
+    claves = filtered['municipio_clave'].to_numpy()
+    desplazamiento = -min(int(claves.min()), 0) if len(claves) else 0
+    codigos = claves + desplazamiento
+    conteo = np.bincount(codigos)
+    presentes = np.flatnonzero(conteo)
+    sumar = lambda columna: np.bincount(codigos, weights=filtered[columna].to_numpy(), minlength=len(conteo))[presentes]
+    
+    # Primera fila de cada municipio, para su etiqueta, departamento y llave geográfica
+    primera = np.empty(len(conteo), dtype=np.int64)
+    primera[codigos[::-1]] = np.arange(len(codigos) - 1, -1, -1)
+    filas = primera[presentes]
+    municipio_id = filtered['municipio_id'].to_numpy()[filas]
+    
+    return pd.DataFrame({
+        'Municipio': filtered['Municipio (etiqueta)'].to_numpy()[filas].astype(object),
+        'Departamento': filtered['Departamento'].to_numpy()[filas].astype(object),
+        'municipio_id': municipio_id,
+        'proyectos': conteo[presentes],
+        'inversion': sumar('Costo total ($COP)'),
+        'beneficiarios': sumar('Beneficiarios totales').astype(np.int64),
+        'area': sumar('Área intervenida (ha)'),
+        'aip': np.where(municipio_id >= 0, aip_por_municipio[municipio_id], 0)
+    }, index=pd.Index(presentes - desplazamiento, name='municipio_clave')).sort_values('Municipio', kind='stable')
+
+def filtrar_proyectos(filtros, datos):
+    filtered = datos.df.iloc[datos.motor.filtrar(filtros)]
+    return ResultadoFiltro(filtered, agregar_por_municipio(filtered))
+
+def referencia_filtros(filtros, datos):
+    return {'clave': huella_filtros({'filtros': filtros, 'version': datos.version}),
+            'filtros': filtros, 'version': datos.version}
+
+def obtener_filtrado(referencia, datos):
+    # Durante una recarga el Store puede venir de un worker con otra versión de
+    # los datos: el resultado se guarda con la clave de la versión de este worker
+    if referencia.get('version') != datos.version:
+        referencia = referencia_filtros(referencia['filtros'], datos)
+    resultado = resultados_filtrados.obtener(referencia['clave'])
+    if resultado is None:
+        resultado = filtrar_proyectos(referencia['filtros'], datos)
+        resultados_filtrados.guardar(referencia['clave'], resultado)
+    return resultado
+
 @app.callback(
     Output('selected-municipio-title', 'children'),
-    [Input('selected-municipio', 'data')]
+    [Input('selected-municipio', 'data')],
+    [State('filtered-data', 'data')]
 )
-def update_map_title(selected_municipio):
-    if selected_municipio:
-        return html.Div([
-            " ",
-            html.Span(selected_municipio, style={'color': colors['map-highlight']})
-        ])
+def update_map_title(selected_municipio, filtered_data):
+    if selected_municipio is not None and filtered_data:
+        municipios = obtener_filtrado(filtered_data, gestor_datos.actual).municipios
+        if selected_municipio in municipios.index:
+            return html.Div([
+                " ",
+                html.Span(municipios.at[selected_municipio, 'Municipio'], style={'color': colors['map-highlight']})
+            ])
     return ""
 
-@app.callback(
-    [Output('filtered-data', 'data'),
-     Output('total-proyectos', 'children'),
-     Output('total-inversion', 'children'),
-     Output('total-beneficiarios', 'children'),
-     Output('total-area', 'children'),
-     Output('mapa', 'figure'),
-     Output('map-center', 'data')],
-    [Input('tipo-dropdown', 'value'),
-     Input('departamento-dropdown', 'value'),
-     Input('comunidad-dropdown', 'value'),
-     Input('year-slider', 'value'),
-     Input('costo-slider', 'value'),
-     Input('selected-municipio', 'data')],
-    [State('map-center', 'data'),
-     State('filtered-data', 'data')]
-)
-def update_filtered_data(tipos, departamentos, comunidades, anos, costos, selected_municipio, current_map_center, current_filtered_data):
-    ctx = callback_context
-    triggered_input = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
-    
-    filtered = df[
-        (df['Fecha inicio'].dt.year >= anos[0]) & 
-        (df['Fecha inicio'].dt.year <= anos[1]) &
-        (df['Costo total ($COP)'] >= costos[0]*1000000) &
-        (df['Costo total ($COP)'] <= costos[1]*1000000)
-    ]
-    
-    if tipos:
-        filtered = filtered[filtered['Tipo de proyecto'].isin(tipos)]
-    if departamentos:
-        filtered = filtered[filtered['Departamento'].isin(departamentos)]
-    if comunidades:
-        filtered = filtered[filtered['Comunidad beneficiaria'].isin(comunidades)]
+def calcular_kpis(municipios):
+    if municipios.empty:
+        return ("0", "$0M", "0", "0 ha")
     
+    total_proyectos = int(municipios['proyectos'].sum())
+    total_inversion = f"${municipios['inversion'].sum()/1000000:,.0f}M"
+    total_beneficiarios = f"{int(municipios['beneficiarios'].sum()):,}"
+    total_area = f"{municipios['area'].sum():,.1f} ha"
+    return (total_proyectos, total_inversion, total_beneficiarios, total_area)
+
+def codigos_resaltado(municipios, selected_municipio):
+    if selected_municipio is None or selected_municipio not in municipios.index:
+        return []
+    municipio_id = municipios.at[selected_municipio, 'municipio_id']
+    return [fichas_municipios[municipio_id].codigo] if municipio_id >= 0 else []
+
+def traza_resaltado(codigos, zoom):
+    return px.choropleth_mapbox(
+        pd.DataFrame({'MpCodigo': pd.Series(codigos, dtype=str)}),
+        geojson=url_geojson_municipios(zoom),
+        locations='MpCodigo',
+        featureidkey='id',
+        color_discrete_sequence=[colors['map-highlight']]
+    ).update_traces(
+        hovertemplate=None,
+        hoverinfo='skip',
+        showlegend=False
+    ).data[0]
+
+def calcular_centro_mapa(municipios, selected_municipio, current_map_center, enfocar_municipio):
+    if municipios.empty:
+        return {'lat': 4.6, 'lon': -74.1, 'zoom': 4.5}
+    if enfocar_municipio and selected_municipio is not None:
+        if selected_municipio in municipios.index:
+            municipio_id = municipios.at[selected_municipio, 'municipio_id']
+            if municipio_id >= 0:
+                return fichas_municipios[municipio_id].vista
+        return current_map_center
+    return current_map_center if current_map_center else {'lat': 4.6, 'lon': -74.1, 'zoom': 4.5}
+
+def parchear_figura_mapa(municipios, selected_municipio, map_center, trazas):
+    # Solo cambia el municipio seleccionado: se reemplaza la traza de resaltado,
+    # el centro/zoom y la URL del nivel de detalle de las trazas base
+    fig_patch = Patch()
+    geojson_url = url_geojson_municipios(map_center['zoom'])
+    for i in range(trazas - 2):
+        fig_patch['data'][i]['geojson'] = geojson_url
+    fig_patch['data'][trazas - 1] = traza_resaltado(
+        codigos_resaltado(municipios, selected_municipio), map_center['zoom']
+    ).to_plotly_json()
+    fig_patch['layout']['mapbox']['center'] = {'lat': map_center['lat'], 'lon': map_center['lon']}
+    fig_patch['layout']['mapbox']['zoom'] = map_center['zoom']
+    return fig_patch
+
+def construir_figura_mapa(resultado, selected_municipio, map_center):
+    filtered = resultado.proyectos
     if filtered.empty:
         fig = px.choropleth_mapbox(
             title="No hay datos que coincidan con los filtros aplicados",
@@ -912,42 +1618,18 @@ def update_filtered_data(tipos, departamentos, comunidades, anos, costos, select
             )]
         )
         
-        return (
-            [],
-            "0",
-            "$0M",
-            "0",
-            "0 ha",
-            fig,
-            {'lat': 4.6, 'lon': -74.1, 'zoom': 4.5}
-        )
-    
-    filtered_with_geom = pd.merge(
-        filtered,
-        municipios_gdf[['MpNombre', 'Depto', 'geometry', 'lon', 'lat']],
-        left_on=['Municipio', 'Departamento'],
-        right_on=['MpNombre', 'Depto'],
-        how='left'
-    )
+        return fig.to_dict(), 0
     
-    filtered_gdf = gpd.GeoDataFrame(filtered_with_geom)
-    
-    if triggered_input == 'selected-municipio' and selected_municipio and current_filtered_data:
-        filtered_df = pd.DataFrame(current_filtered_data)
-        municipio_data = filtered_df[filtered_df['Municipio'] == selected_municipio]
-        if not municipio_data.empty:
-            departamento = municipio_data.iloc[0]['Departamento']
-            bbox = get_municipio_bbox(selected_municipio, departamento)
-            if bbox:
-                map_center = bbox
-            else:
-                map_center = current_map_center
-        else:
-            map_center = current_map_center
-    else:
-        map_center = current_map_center if current_map_center else {'lat': 4.6, 'lon': -74.1, 'zoom': 4.5}
-    
-    filtered_with_geometry = filtered_gdf[~filtered_gdf.geometry.isna()]
+    # Unión con el shapefile por la llave entera precalculada
+    filtered_with_geometry = filtered[filtered['municipio_id'].to_numpy() >= 0]
+    filas_geometria = filtered_with_geometry['municipio_id'].to_numpy()
+    filtered_with_geometry = filtered_with_geometry.assign(**{
+        columna: municipios_tabla[columna].to_numpy()[filas_geometria]
+        for columna in ['MpCodigo', 'MpNombre', 'Depto']
+    }, **{
+        # plotly express agrupa también las categorías sin filas filtradas
+        'Tipo de proyecto': filtered_with_geometry['Tipo de proyecto'].astype(object)
+    })
     
     if filtered_with_geometry.empty:
         fig = px.choropleth_mapbox(
@@ -970,12 +1652,14 @@ def update_filtered_data(tipos, departamentos, comunidades, anos, costos, select
                 font=dict(size=20)
             )]
         )
+        trazas = 0
     else:
         # Crear figura base con los municipios
         fig = px.choropleth_mapbox(
             filtered_with_geometry,
-            geojson=filtered_with_geometry.geometry,
-            locations=filtered_with_geometry.index,
+            geojson=url_geojson_municipios(map_center['zoom']),
+            locations='MpCodigo',
+            featureidkey='id',
             color="Tipo de proyecto",
             color_discrete_sequence=px.colors.qualitative.Pastel,
             center={"lat": map_center['lat'], "lon": map_center['lon']},
@@ -992,40 +1676,22 @@ def update_filtered_data(tipos, departamentos, comunidades, anos, costos, select
         # Agregar puntos de ubicaciones AIP con información de Municipio y Departamento
         fig.add_trace(
             px.scatter_mapbox(
-                aip_locations_gdf,
-                lat=aip_locations_gdf.geometry.y,
-                lon=aip_locations_gdf.geometry.x,
+                aip_locations_tabla,
+                lat='lat',
+                lon='lon',
                 color_discrete_sequence=['#90EE90']  # Verde claro notorio
             ).update_traces(
                 marker=dict(size=10, opacity=0.8),
                 name="Cobertura de trabajo AIP",  # Leyenda para los puntos
                 hovertemplate="<b>Municipio: %{customdata[0]}</b><br>Departamento: %{customdata[1]}<extra></extra>",
-                customdata=aip_locations_gdf[["Municipio", "Departamen"]],
+                customdata=aip_locations_tabla[["Municipio", "Departamen", "municipio_id"]],
                 showlegend=True  # Asegurar que aparezca en la leyenda
             ).data[0]
         )
         
-        if selected_municipio and current_filtered_data:
-            filtered_df = pd.DataFrame(current_filtered_data)
-            municipio_data = filtered_df[filtered_df['Municipio'] == selected_municipio]
-            if not municipio_data.empty:
-                departamento = municipio_data.iloc[0]['Departamento']
-                selected_municipio_geom = municipios_gdf[
-                    (municipios_gdf['MpNombre'] == selected_municipio.upper().strip()) & 
-                    (municipios_gdf['Depto'] == departamento.upper().strip())
-                ]
-                if not selected_municipio_geom.empty:
-                    fig.add_trace(
-                        px.choropleth_mapbox(
-                            selected_municipio_geom,
-                            geojson=selected_municipio_geom.geometry,
-                            locations=selected_municipio_geom.index,
-                            color_discrete_sequence=[colors['map-highlight']]
-                        ).update_traces(
-                            hovertemplate=None,
-                            hoverinfo='skip'
-                        ).data[0]
-                    )
+        # La traza de resaltado siempre es la última para poder reemplazarla con Patch
+        fig.add_trace(traza_resaltado(codigos_resaltado(resultado.municipios, selected_municipio), map_center['zoom']))
+        trazas = len(fig.data)
     
     fig.update_layout(
         mapbox_style="carto-positron",
@@ -1043,69 +1709,264 @@ def update_filtered_data(tipos, departamentos, comunidades, anos, costos, select
         clickmode='event+select'
     )
     
-    total_proyectos = len(filtered)
-    total_inversion = f"${filtered['Costo total ($COP)'].sum()/1000000:,.0f}M"
-    total_beneficiarios = f"{filtered['Beneficiarios totales'].sum():,}"
-    total_area = f"{filtered['Área intervenida (ha)'].sum():,.1f} ha"
+    return fig.to_dict(), trazas
+
+@app.callback(
+    [Output('filtered-data', 'data'),
+     Output('total-proyectos', 'children'),
+     Output('total-inversion', 'children'),
+     Output('total-beneficiarios', 'children'),
+     Output('total-area', 'children'),
+     Output('mapa', 'figure'),
+     Output('map-center', 'data')],
+    [Input('tipo-dropdown', 'value'),
+     Input('departamento-dropdown', 'value'),
+     Input('comunidad-dropdown', 'value'),
+     Input('year-slider', 'value'),
+     Input('costo-slider', 'value'),
+     Input('filtro-espacial', 'data'),
+     Input('selected-municipio', 'data')],
+    [State('map-center', 'data'),
+     State('filtered-data', 'data')]
+)
+def update_filtered_data(tipos, departamentos, comunidades, anos, costos, filtro_espacial, selected_municipio, current_map_center, current_filtered_data):
+    ctx = callback_context
+    triggered_input = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+    
+    datos = gestor_datos.actual
+    filtros = normalizar_filtros(tipos, departamentos, comunidades, anos, costos, filtro_espacial)
+    referencia = referencia_filtros(filtros, datos)
+    
+    if (triggered_input == 'selected-municipio' and current_filtered_data and
+            current_filtered_data['clave'] == referencia['clave'] and current_filtered_data.get('trazas')):
+        resultado = obtener_filtrado(current_filtered_data, datos)
+        map_center = calcular_centro_mapa(resultado.municipios, selected_municipio, current_map_center, True)
+        return (
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
+            parchear_figura_mapa(resultado.municipios, selected_municipio, map_center, current_filtered_data['trazas']),
+            map_center
+        )
+    
+    resultado = obtener_filtrado(referencia, datos)
+    map_center = calcular_centro_mapa(resultado.municipios, selected_municipio, current_map_center,
+                                      triggered_input == 'selected-municipio')
     
+    clave_vista = huella_filtros({
+        'filtros': filtros,
+        'municipio': selected_municipio,
+        'centro': map_center,
+        'version': datos.version
+    })
+    vista = vistas_mapa.obtener(clave_vista)
+    if vista is None:
+        figura, trazas = construir_figura_mapa(resultado, selected_municipio, map_center)
+        vista = {'kpis': calcular_kpis(resultado.municipios), 'figura': figura, 'trazas': trazas}
+        vistas_mapa.guardar(clave_vista, vista)
+    
+    # 'trazas' permite actualizar después solo el resaltado mediante Patch
     return (
-        filtered.to_dict('records'),
-        total_proyectos,
-        total_inversion,
-        total_beneficiarios,
-        total_area,
-        fig,
+        {**referencia, 'trazas': vista['trazas']} if not resultado.proyectos.empty else None,
+        *vista['kpis'],
+        vista['figura'],
         map_center
     )
 
+# Preagregado por año e intervalo de costo para los filtros categóricos actuales.
+# Un proyecto con costo x cae en [piso, techo] de múltiplos de 'paso_costos' y
+# queda dentro del rango [c0, c1] del slider si y solo si c0 <= piso y techo <= c1.
+def preagregar_kpis(filtros, datos):
+    filas = datos.df.iloc[np.flatnonzero(datos.motor.mascara_categorias(filtros))]
+    costo = filas['Costo (millones)']
+    grupos = filas.groupby([
+        filas['Año inicio'].rename('ano'),
+        (np.floor(costo / paso_costos) * paso_costos).rename('minimo'),
+        (np.ceil(costo / paso_costos) * paso_costos).rename('maximo')
+    ]).agg(
+        proyectos=('ID', 'size'),
+        inversion=('Costo total ($COP)', 'sum'),
+        beneficiarios=('Beneficiarios totales', 'sum'),
+        area=('Área intervenida (ha)', 'sum')
+    ).reset_index()
+    return {columna: grupos[columna].tolist() for columna in grupos.columns}
+
 @app.callback(
-    Output('municipios-cards-container', 'children'),
-    [Input('filtered-data', 'data')],
-    [State('selected-municipio', 'data')]
+    Output('kpis-preagregado', 'data'),
+    [Input('tipo-dropdown', 'value'),
+     Input('departamento-dropdown', 'value'),
+     Input('comunidad-dropdown', 'value'),
+     Input('filtro-espacial', 'data')]
 )
-def update_municipios_list(filtered_data, selected_municipio):
-    if not filtered_data:
-        return html.Div("No hay municipios con los filtros actuales", style={
-            'textAlign': 'center', 
-            'color': 'white', 
-            'fontSize': '22px',
-            'padding': '15px',
-            'backgroundColor': 'rgba(0,0,0,0.2)',
-            'borderRadius': '8px'
-        })
+def update_kpis_preagregado(tipos, departamentos, comunidades, filtro_espacial):
+    return preagregar_kpis({'tipos': tipos, 'departamentos': departamentos, 'comunidades': comunidades,
+                            'municipios': filtro_espacial},
+                           gestor_datos.actual)
+
+# Filtro espacial: la caja o el lazo dibujado en el mapa se resuelve con el
+# índice espacial a los municipios que intersecta, que entran al mismo
+# pipeline de filtros que los desplegables
+def municipios_en_seleccion(selected_data):
+    if 'mapbox' in selected_data.get('range', {}):
+        (x0, y0), (x1, y1) = selected_data['range']['mapbox']
+        filas = indice_espacial.municipios_en_caja(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+    elif len(selected_data.get('lassoPoints', {}).get('mapbox', [])) >= 3:
+        filas = indice_espacial.municipios_en_poligono(selected_data['lassoPoints']['mapbox'])
+    else:
+        return None
+    return filas.tolist()
+
+# En modo radio, el clic en el mapa fija el centro y el filtro son los
+# municipios cuyo centroide está a menos del radio elegido
+def municipios_en_radio(map_click, radio_km):
+    if not map_click or not map_click.get('points'):
+        return None
+    centro = centro_de_click(map_click['points'][0])
+    if centro is None:
+        return None
+    radio = radio_km * 1000
+    return (indice_radio_municipios.dentro(*centro, radio).tolist(),
+            len(indice_radio_aip.dentro(*centro, radio)))
+
+@app.callback(
+    [Output('filtro-espacial', 'data'),
+     Output('limpiar-filtro-espacial', 'className'),
+     Output('limpiar-filtro-espacial', 'children')],
+    [Input('mapa', 'selectedData'),
+     Input('limpiar-filtro-espacial', 'n_clicks'),
+     Input('mapa', 'clickData'),
+     Input('radio-busqueda', 'value'),
+     Input('modo-radio', 'value')],
+    prevent_initial_call=True
+)
+def update_filtro_espacial(selected_data, limpiar, map_click, radio_km, modo_radio):
+    ctx = callback_context
+    triggered_input = ctx.triggered[0]['prop_id'] if ctx.triggered else None
     
-    filtered_df = pd.DataFrame(filtered_data)
-    municipios = filtered_df['Municipio'].unique()
+    if triggered_input == 'limpiar-filtro-espacial.n_clicks':
+        return None, 'filtro-espacial-limpiar', ""
     
-    cards = []
-    for municipio in sorted(municipios):
-        count = len(filtered_df[filtered_df['Municipio'] == municipio])
-        is_selected = municipio == selected_municipio
-        
-        card_style = styles['municipio-card-selected'] if is_selected else styles['municipio-card']
-        name_style = styles['municipio-name-selected'] if is_selected else styles['municipio-name']
-        count_style = styles['municipio-projects-selected'] if is_selected else styles['municipio-projects']
-        
-        cards.append(
-            html.Div(
-                [
-                    html.Div(municipio, style=name_style),
-                    html.Div(f"{count} proyecto{'s' if count > 1 else ''}", style=count_style)
-                ],
-                id={'type': 'municipio-card', 'index': municipio},
-                style=card_style,
-                n_clicks=0
-            )
+    if triggered_input in ('mapa.clickData', 'radio-busqueda.value', 'modo-radio.value'):
+        if not modo_radio:
+            if triggered_input == 'modo-radio.value':
+                return None, 'filtro-espacial-limpiar', ""
+            raise PreventUpdate
+        busqueda = municipios_en_radio(map_click, radio_km)
+        if busqueda is None:
+            raise PreventUpdate
+        municipios, puntos_aip = busqueda
+        return (
+            municipios,
+            'filtro-espacial-limpiar activo',
+            f"✕ Quitar filtro de {radio_km} km ({len(municipios)} municipio{'s' if len(municipios) != 1 else ''}, "
+            f"{puntos_aip} punto{'s' if puntos_aip != 1 else ''} AIP)"
         )
     
-    return cards if cards else html.Div("No hay municipios con los filtros actuales", style={
-        'textAlign': 'center', 
-        'color': 'white', 
-        'fontSize': '22px',
-        'padding': '15px',
-        'backgroundColor': 'rgba(0,0,0,0.2)',
-        'borderRadius': '8px'
-    })
+    if not selected_data:
+        return None, 'filtro-espacial-limpiar', ""
+    
+    # Los clics (clickmode 'event+select') también generan selectedData, sin región
+    municipios = municipios_en_seleccion(selected_data)
+    if municipios is None:
+        raise PreventUpdate
+    
+    return (
+        municipios,
+        'filtro-espacial-limpiar activo',
+        f"✕ Quitar filtro del mapa ({len(municipios)} municipio{'s' if len(municipios) != 1 else ''})"
+    )
+
+# Mientras se arrastra un slider los KPIs se calculan en el navegador; el mapa
+# solo se reconstruye al soltarlo (updatemode='mouseup')
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='kpis_arrastre'),
+    [Output('total-proyectos', 'children', allow_duplicate=True),
+     Output('total-inversion', 'children', allow_duplicate=True),
+     Output('total-beneficiarios', 'children', allow_duplicate=True),
+     Output('total-area', 'children', allow_duplicate=True)],
+    [Input('costo-slider', 'drag_value'),
+     Input('year-slider', 'drag_value')],
+    [State('costo-slider', 'value'),
+     State('year-slider', 'value'),
+     State('kpis-preagregado', 'data')],
+    prevent_initial_call=True
+)
+
+# Lista de municipios paginada: solo se renderizan las tarjetas de la página
+# visible y su aspecto depende de clases CSS (assets/dashboard.css)
+tarjetas_por_pagina = 40
+
+def tarjeta_municipio(clave, resumen, seleccionado):
+    count = resumen['proyectos']
+    return html.Div(
+        [
+            html.Div(resumen['Municipio'], className='municipio-nombre'),
+            html.Div(f"{count} proyecto{'s' if count > 1 else ''}", className='municipio-proyectos'),
+            html.Div(f"${resumen['inversion']/1000000:,.0f}M · {resumen['beneficiarios']:,} beneficiarios",
+                     className='municipio-proyectos'),
+            html.Div(f"{resumen['aip']} punto{'s' if resumen['aip'] > 1 else ''} AIP",
+                     className='municipio-proyectos') if resumen['aip'] else None
+        ],
+        id={'type': 'municipio-card', 'index': int(clave)},
+        className='municipio-card seleccionada' if seleccionado else 'municipio-card',
+        n_clicks=0
+    )
+
+@app.callback(
+    [Output('municipios-cards-container', 'children'),
+     Output('municipios-pagina', 'data'),
+     Output('municipios-pagina-texto', 'children'),
+     Output('municipios-anterior', 'disabled'),
+     Output('municipios-siguiente', 'disabled'),
+     Output('municipios-paginacion', 'style')],
+    [Input('filtered-data', 'data'),
+     Input('municipios-anterior', 'n_clicks'),
+     Input('municipios-siguiente', 'n_clicks'),
+     Input('selected-municipio', 'data')],
+    [State('municipios-pagina', 'data')]
+)
+def update_municipios_list(filtered_data, anterior, siguiente, selected_municipio, pagina):
+    ctx = callback_context
+    triggered_input = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+    
+    if not filtered_data:
+        return (html.Div("No hay municipios con los filtros actuales", className='municipios-vacio'),
+                0, "", True, True, {'display': 'none'})
+    
+    municipios = obtener_filtrado(filtered_data, gestor_datos.actual).municipios
+    total_paginas = max(1, -(-len(municipios) // tarjetas_por_pagina))
+    pagina_seleccionado = (municipios.index.get_loc(selected_municipio) // tarjetas_por_pagina
+                           if selected_municipio in municipios.index else None)
+    
+    if triggered_input == 'municipios-anterior':
+        pagina = (pagina or 0) - 1
+    elif triggered_input == 'municipios-siguiente':
+        pagina = (pagina or 0) + 1
+    elif triggered_input == 'selected-municipio':
+        # Si la tarjeta ya está visible, el cambio de clase lo hace el navegador
+        if pagina_seleccionado is None or pagina_seleccionado == pagina:
+            raise PreventUpdate
+        pagina = pagina_seleccionado
+    else:
+        pagina = pagina_seleccionado or 0
+    pagina = min(max(pagina, 0), total_paginas - 1)
+    
+    inicio = pagina * tarjetas_por_pagina
+    cards = [
+        tarjeta_municipio(clave, resumen, clave == selected_municipio)
+        for clave, resumen in municipios.iloc[inicio:inicio + tarjetas_por_pagina].iterrows()
+    ]
+    
+    return (
+        cards if cards else html.Div("No hay municipios con los filtros actuales", className='municipios-vacio'),
+        pagina,
+        f"Página {pagina + 1} de {total_paginas}",
+        pagina == 0,
+        pagina == total_paginas - 1,
+        {} if total_paginas > 1 else {'display': 'none'}
+    )
 
 @app.callback(
     [Output('selected-municipio', 'data'),
@@ -1115,7 +1976,6 @@ def update_municipios_list(filtered_data, selected_municipio):
      Output('duracion-value', 'children'),
      Output('area-value', 'children'),
      Output('producto-value', 'children'),
-     Output({'type': 'municipio-card', 'index': ALL}, 'style'),
      Output('proyecto-selector', 'options'),
      Output('proyecto-selector', 'value'),
      Output('photo-buttons', 'children'),
@@ -1123,50 +1983,48 @@ def update_municipios_list(filtered_data, selected_municipio):
     [Input({'type': 'municipio-card', 'index': ALL}, 'n_clicks'),
      Input('mapa', 'clickData'),
      Input('proyecto-selector', 'value')],
-    [State('filtered-data', 'data'),
-     State({'type': 'municipio-card', 'index': ALL}, 'id'),
-     State('municipios-cards-container', 'children')],
+    [State('filtered-data', 'data')],
     prevent_initial_call=True
 )
-def handle_municipio_selection(clicks, map_click, selected_proyecto, filtered_data, municipio_ids, municipios_cards):
+def handle_municipio_selection(clicks, map_click, selected_proyecto, filtered_data):
     ctx = callback_context
     
     if not ctx.triggered or not filtered_data:
-        default_styles = [styles['municipio-card'] for _ in municipio_ids] if municipio_ids else []
         return [
             None, "Seleccione un municipio", "0", "N/A", "0", "0", "N/A", 
-            default_styles,
             [], None, [], None
         ]
     
     trigger_id = ctx.triggered[0]['prop_id']
+    datos = gestor_datos.actual
     
     if trigger_id == 'mapa.clickData':
         if map_click and 'points' in map_click and map_click['points']:
             point = map_click['points'][0]
-            if 'customdata' in point and len(point['customdata']) == 4:  # Es un polígono
-                municipio = point['customdata'][0]
-            else:  # Es un punto de ubicación AIP
-                municipio = point['customdata'][0] if 'customdata' in point and point['customdata'] else None
+            # Todo clic se resuelve a la fila canónica del municipio, que es la
+            # clave del resumen para los municipios con coincidencia; solo un
+            # municipio sin proyectos filtrados deja la selección vacía
+            municipio_id = municipio_de_click(point)
+            municipios = obtener_filtrado(filtered_data, datos).municipios
+            municipio = municipio_id if municipio_id is not None and municipio_id in municipios.index else None
         else:
-            default_styles = [styles['municipio-card'] for _ in municipio_ids] if municipio_ids else []
             return [
                 None, "Seleccione un municipio", "0", "N/A", "0", "0", "N/A", 
-                default_styles,
                 [], None, [], None
             ]
     elif trigger_id == 'proyecto-selector.value':
-        filtered_df = pd.DataFrame(filtered_data)
+        filtered_df = obtener_filtrado(filtered_data, datos).proyectos
         municipio_data = filtered_df[filtered_df['ID'] == selected_proyecto]
         if not municipio_data.empty:
-            municipio = municipio_data.iloc[0]['Municipio']
+            municipio = municipio_data.iloc[0]['municipio_clave']
         else:
             raise PreventUpdate
     else:
         municipio = json.loads(trigger_id.split('.')[0].replace("'", '"'))['index']
     
-    filtered_df = pd.DataFrame(filtered_data)
-    municipio_data = filtered_df[filtered_df['Municipio'] == municipio]
+    resultado = obtener_filtrado(filtered_data, datos)
+    filtered_df = resultado.proyectos
+    municipio_data = filtered_df[filtered_df['municipio_clave'].to_numpy() == municipio] if municipio is not None else filtered_df.iloc[:0]
     
     if trigger_id == 'proyecto-selector.value' and selected_proyecto:
         proyecto_data = municipio_data[municipio_data['ID'] == selected_proyecto].iloc[0]
@@ -1175,10 +2033,8 @@ def handle_municipio_selection(clicks, map_click, selected_proyecto, filtered_da
         selected_proyecto = proyecto_data['ID'] if proyecto_data is not None else None
     
     if proyecto_data is None:
-        default_styles = [styles['municipio-card'] for _ in municipio_ids] if municipio_ids else []
         return [
             None, "Seleccione un municipio", "0", "N/A", "0", "0", "N/A", 
-            default_styles,
             [], None, [], None
         ]
     
@@ -1188,13 +2044,6 @@ def handle_municipio_selection(clicks, map_click, selected_proyecto, filtered_da
     area = f"{proyecto_data['Área intervenida (ha)']:,.1f}"
     producto = proyecto_data['Producto principal generado']
     
-    card_styles = []
-    for m_id in municipio_ids:
-        if m_id['index'] == municipio:
-            card_styles.append(styles['municipio-card-selected'])
-        else:
-            card_styles.append(styles['municipio-card'])
-    
     proyectos_options = [{'label': f"Proyecto {row['ID']} - {row['Tipo de proyecto']}", 'value': row['ID']} 
                         for _, row in municipio_data.iterrows()]
     
@@ -1202,16 +2051,19 @@ def handle_municipio_selection(clicks, map_click, selected_proyecto, filtered_da
     buttons = []
     if selected_proyecto:
         for i in [1, 2]:
-            foto_path = f"assets/fotos/Rf {i} proyecto {selected_proyecto}.jpg"
-            if os.path.exists(foto_path):
-                encoded_image = encode_image(foto_path)
+            foto_url = url_foto(selected_proyecto, i, 'pantalla')
+            if foto_url:
                 foto_data.append({
                     'photo_num': i,
-                    'image': encoded_image
+                    'url': foto_url
                 })
                 buttons.append(
                     html.Button(
-                        f"Ver evidencia {i}",
+                        [
+                            html.Img(src=url_foto(selected_proyecto, i, 'miniatura'),
+                                     alt=f"Evidencia {i}", style=styles['photo-thumbnail']),
+                            f"Ver evidencia {i}"
+                        ],
                         id={'type': 'photo-button', 'index': i},
                         n_clicks=0,
                         style=styles['photo-button']
@@ -1219,66 +2071,38 @@ def handle_municipio_selection(clicks, map_click, selected_proyecto, filtered_da
                 )
     
     return [
-        municipio, 
-        municipio, 
+        int(municipio), 
+        resultado.municipios.at[municipio, 'Municipio'], 
         f"{beneficiarios:,}", 
         financiador, 
         duracion, 
         area, 
         producto, 
-        card_styles,
         proyectos_options,
         selected_proyecto,
         buttons,
         foto_data
     ]
 
-@app.callback(
-    Output('photo-modal', 'style'),
+# Interacciones puramente visuales resueltas en el navegador (assets/dashboard.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='mostrar_foto'),
+    [Output('photo-modal', 'style'),
+     Output('modal-image', 'src')],
     [Input({'type': 'photo-button', 'index': ALL}, 'n_clicks'),
      Input('close-modal', 'n_clicks')],
     [State('photo-store', 'data')],
     prevent_initial_call=True
 )
-def toggle_modal(photo_clicks, close_click, foto_data):
-    ctx = callback_context
-    if not ctx.triggered:
-        raise PreventUpdate
-    
-    trigger_id = ctx.triggered[0]['prop_id']
-    
-    if 'close-modal' in trigger_id:
-        return {'display': 'none'}
-    
-    if foto_data and any(photo_clicks):
-        button_id = json.loads(ctx.triggered[0]['prop_id'].split('.')[0])
-        photo_num = button_id['index']
-        
-        for foto in foto_data:
-            if foto['photo_num'] == photo_num:
-                return {'display': 'flex'}
-    
-    return {'display': 'none'}
 
-@app.callback(
-    Output('modal-image', 'src'),
-    [Input({'type': 'photo-button', 'index': ALL}, 'n_clicks')],
-    [State('photo-store', 'data')],
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='clases_tarjetas'),
+    Output({'type': 'municipio-card', 'index': ALL}, 'className'),
+    [Input('selected-municipio', 'data')],
+    [State({'type': 'municipio-card', 'index': ALL}, 'id'),
+     State({'type': 'municipio-card', 'index': ALL}, 'className')],
     prevent_initial_call=True
 )
-def update_modal_image(photo_clicks, foto_data):
-    ctx = callback_context
-    if not ctx.triggered or not foto_data:
-        raise PreventUpdate
-    
-    button_id = json.loads(ctx.triggered[0]['prop_id'].split('.')[0])
-    photo_num = button_id['index']
-    
-    for foto in foto_data:
-        if foto['photo_num'] == photo_num:
-            return foto['image']
-    
-    raise PreventUpdate
 
 # 6. Ejecutar la aplicación
 server = app.server
@@ -0,0 +1,70 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        // Abre o cierra el modal de fotografías y asigna la URL de la imagen
+        mostrar_foto: function(photo_clicks, close_click, foto_data) {
+            const no_update = window.dash_clientside.no_update;
+            const triggered = window.dash_clientside.callback_context.triggered;
+            if (!triggered || !triggered.length) {
+                return [no_update, no_update];
+            }
+
+            const prop_id = triggered[0].prop_id;
+            if (prop_id.startsWith('close-modal')) {
+                return [{display: 'none'}, no_update];
+            }
+            if (!foto_data || !photo_clicks.some(Boolean)) {
+                return [{display: 'none'}, no_update];
+            }
+
+            const photo_num = JSON.parse(prop_id.split('.')[0]).index;
+            const foto = foto_data.find(f => f.photo_num === photo_num);
+            return foto ? [{display: 'flex'}, foto.url] : [{display: 'none'}, no_update];
+        },
+
+        // KPIs provisionales durante el arrastre de los sliders, a partir del
+        // preagregado por año e intervalo de costo
+        kpis_arrastre: function(costos_arrastre, anos_arrastre, costos, anos, preagregado) {
+            const no_update = window.dash_clientside.no_update;
+            if (!preagregado) {
+                return [no_update, no_update, no_update, no_update];
+            }
+            costos = costos_arrastre || costos;
+            anos = anos_arrastre || anos;
+
+            let proyectos = 0, inversion = 0, beneficiarios = 0, area = 0;
+            for (let i = 0; i < preagregado.ano.length; i++) {
+                if (preagregado.ano[i] >= anos[0] && preagregado.ano[i] <= anos[1] &&
+                        preagregado.minimo[i] >= costos[0] && preagregado.maximo[i] <= costos[1]) {
+                    proyectos += preagregado.proyectos[i];
+                    inversion += preagregado.inversion[i];
+                    beneficiarios += preagregado.beneficiarios[i];
+                    area += preagregado.area[i];
+                }
+            }
+            if (!proyectos) {
+                return ["0", "$0M", "0", "0 ha"];
+            }
+
+            const formato = (valor, decimales) => valor.toLocaleString('en-US', {
+                minimumFractionDigits: decimales,
+                maximumFractionDigits: decimales
+            });
+            return [
+                proyectos,
+                `$${formato(inversion / 1000000, 0)}M`,
+                formato(beneficiarios, 0),
+                `${formato(area, 1)} ha`
+            ];
+        },
+
+        // Resalta la tarjeta del municipio seleccionado; solo se envía la clase
+        // de las tarjetas que cambian (la seleccionada antes y la nueva)
+        clases_tarjetas: function(selected_municipio, municipio_ids, clases) {
+            const no_update = window.dash_clientside.no_update;
+            return municipio_ids.map(function(m_id, i) {
+                const clase = m_id.index === selected_municipio ? 'municipio-card seleccionada' : 'municipio-card';
+                return clase === clases[i] ? no_update : clase;
+            });
+        }
+    }
+});
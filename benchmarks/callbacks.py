@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de los callbacks del dashboard con bases sintéticas.
+
+Genera bases de proyectos con el esquema de data/proyectos.xlsx (semilla fija,
+municipios tomados de los pares MpNombre/Depto reales del artefacto
+geográfico), las instala como versión actual de gestor_datos y llama
+directamente a update_filtered_data, update_municipios_list y
+handle_municipio_selection. Por cada tamaño y callback reporta percentiles de
+latencia, pico de memoria (tracemalloc) y bytes de la respuesta serializada, y
+guarda todo en un JSON para comparar entre commits:
+
+    python benchmarks/callbacks.py --filas 1000 10000 100000 --iteraciones 30
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(raiz)
+sys.path.insert(0, raiz)
+
+# Sin sondeo del Excel: la recarga reemplazaría la base sintética a mitad de la medición
+os.environ['DASHBOARD_INTERVALO_RECARGA'] = '0'
+import app
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+from dash.exceptions import PreventUpdate
+from plotly.io.json import to_json_plotly
+
+def generar_proyectos(filas, semilla):
+    rng = np.random.default_rng(semilla)
+    plantilla = pd.read_excel(app.datos_path)
+
+    # Textos tomados de filas reales; municipios, fechas y medidas sintéticas
+    df = plantilla.iloc[rng.integers(0, len(plantilla), filas)].reset_index(drop=True)
+    municipios = rng.integers(0, len(app.municipios_tabla), filas)
+    df['ID'] = np.arange(1, filas + 1)
+    df['Municipio'] = app.municipios_tabla['MpNombre'].to_numpy()[municipios]
+    df['Departamento'] = app.municipios_tabla['Depto'].to_numpy()[municipios]
+
+    duracion = rng.integers(3, 48, filas)
+    inicio = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 11 * 365, filas), unit='D')
+    df['Fecha inicio'] = inicio
+    df['Fecha fin'] = inicio + pd.to_timedelta(duracion * 30, unit='D')
+    df['Duración del proyecto (meses)'] = duracion
+    df['Costo total ($COP)'] = np.clip(rng.lognormal(np.log(8e8), 1.0, filas), 1e7, 7e9).round().astype(np.int64)
+    df['Área intervenida (ha)'] = rng.gamma(1.5, 200, filas).round(1)
+    df['Beneficiarios directos'] = rng.integers(10, 2000, filas)
+    df['Beneficiarios indirectos'] = rng.integers(0, 5000, filas)
+
+    return app.derivar_columnas(app.preparar_proyectos(df))
+
+def instalar_datos(df, etiqueta):
+    app.gestor_datos.actual = app.DatosProyectos(df, app.MotorFiltros(df), etiqueta, datetime.now())
+
+def filtros_aleatorios(rng, df):
+    tipos = df['Tipo de proyecto'].cat.categories
+    departamentos = df['Departamento'].cat.categories
+    anos = np.sort(rng.integers(df['Año inicio'].min(), df['Año inicio'].max() + 1, 2))
+    costos = np.sort(rng.choice(np.arange(0, 7001, app.paso_costos), 2, replace=False))
+    return {
+        'tipos': list(rng.choice(tipos, rng.integers(0, min(3, len(tipos)) + 1), replace=False)),
+        'departamentos': list(rng.choice(departamentos, rng.integers(0, min(4, len(departamentos)) + 1), replace=False)),
+        'comunidades': [],
+        'anos': [int(anos[0]), int(anos[1])],
+        'costos': [int(0 if rng.random() < 0.5 else costos[0]), int(costos[1])]
+    }
+
+def llamar(funcion, disparador, *args):
+    # Los callbacks leen callback_context; se simula el contexto de Dash
+    context_value.set(AttributeDict(triggered_inputs=[{'prop_id': disparador, 'value': None}]))
+    try:
+        return funcion(*args)
+    except PreventUpdate:
+        return None
+
+def secuencia(rng, df, medir):
+    # Una interacción completa: filtrar, listar municipios, pulsar una tarjeta
+    # y resaltar el municipio en el mapa (ruta Patch)
+    app.resultados_filtrados.limpiar()
+    app.vistas_mapa.limpiar()
+    filtros = filtros_aleatorios(rng, df)
+    centro = {'lat': 4.6, 'lon': -74.1, 'zoom': 4.5}
+
+    respuesta = medir('update_filtered_data', app.update_filtered_data, 'year-slider.value',
+                      filtros['tipos'], filtros['departamentos'], filtros['comunidades'],
+                      filtros['anos'], filtros['costos'], None, None, centro, None)
+    filtered_data = respuesta[0]
+    if not filtered_data:
+        return
+
+    medir('update_municipios_list', app.update_municipios_list, 'filtered-data.data',
+          filtered_data, 0, 0, None, 0)
+
+    municipios = app.obtener_filtrado(filtered_data, app.gestor_datos.actual).municipios
+    municipio = int(municipios.index[rng.integers(0, len(municipios))])
+    tarjeta = json.dumps({'index': municipio, 'type': 'municipio-card'}, ensure_ascii=False, separators=(',', ':'))
+    medir('handle_municipio_selection', app.handle_municipio_selection, f"{tarjeta}.n_clicks",
+          [1], None, None, filtered_data)
+
+    medir('update_filtered_data (resaltado)', app.update_filtered_data, 'selected-municipio.data',
+          filtros['tipos'], filtros['departamentos'], filtros['comunidades'],
+          filtros['anos'], filtros['costos'], None, municipio, centro, filtered_data)
+
+def percentiles(valores):
+    valores = np.asarray(valores, dtype=float)
+    return {
+        'p50': float(np.percentile(valores, 50)),
+        'p90': float(np.percentile(valores, 90)),
+        'p99': float(np.percentile(valores, 99)),
+        'max': float(valores.max())
+    }
+
+def ejecutar(filas, iteraciones, iteraciones_memoria, semilla):
+    df = generar_proyectos(filas, semilla)
+    instalar_datos(df, f"benchmark-{filas}-{semilla}")
+    medidas = {}
+
+    # Latencia y tamaño de respuesta, sin tracemalloc para no distorsionar tiempos
+    def medir_tiempo(nombre, funcion, disparador, *args):
+        inicio = time.perf_counter()
+        resultado = llamar(funcion, disparador, *args)
+        duracion = (time.perf_counter() - inicio) * 1000
+        medida = medidas.setdefault(nombre, {'latencia_ms': [], 'payload_bytes': [], 'memoria_pico_bytes': []})
+        medida['latencia_ms'].append(duracion)
+        medida['payload_bytes'].append(len(to_json_plotly(resultado).encode('utf-8')) if resultado is not None else 0)
+        return resultado
+
+    rng = np.random.default_rng(semilla)
+    secuencia(rng, df, medir_tiempo)  # calentamiento
+    medidas.clear()
+    for _ in range(iteraciones):
+        secuencia(rng, df, medir_tiempo)
+
+    # Pico de memoria por llamada en una pasada aparte
+    def medir_memoria(nombre, funcion, disparador, *args):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        resultado = llamar(funcion, disparador, *args)
+        medidas[nombre]['memoria_pico_bytes'].append(tracemalloc.get_traced_memory()[1] - base)
+        return resultado
+
+    tracemalloc.start()
+    for _ in range(iteraciones_memoria):
+        secuencia(rng, df, medir_memoria)
+    tracemalloc.stop()
+
+    return [
+        {
+            'filas': filas,
+            'callback': nombre,
+            'llamadas': len(medida['latencia_ms']),
+            'latencia_ms': percentiles(medida['latencia_ms']),
+            'payload_bytes': percentiles(medida['payload_bytes']),
+            'memoria_pico_bytes': int(max(medida['memoria_pico_bytes'], default=0))
+        }
+        for nombre, medida in medidas.items()
+    ]
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark de los callbacks del dashboard")
+    parser.add_argument('--filas', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--iteraciones', type=int, default=30)
+    parser.add_argument('--iteraciones-memoria', type=int, default=5)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--salida', default=None)
+    args = parser.parse_args()
+
+    commit = commit_actual()
+    resultados = []
+    for filas in args.filas:
+        print(f"Ejecutando benchmark con {filas:,} proyectos...")
+        resultados.extend(ejecutar(filas, args.iteraciones, args.iteraciones_memoria, args.semilla))
+
+    for resultado in resultados:
+        print(f"{resultado['filas']:>7,}  {resultado['callback']:<34} "
+              f"p50 {resultado['latencia_ms']['p50']:8.1f} ms  p99 {resultado['latencia_ms']['p99']:8.1f} ms  "
+              f"payload {resultado['payload_bytes']['p50'] / 1024:8.1f} KB  "
+              f"memoria {resultado['memoria_pico_bytes'] / 1024 ** 2:7.1f} MB")
+
+    salida = args.salida or os.path.join(
+        "benchmarks", "resultados", f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'sin-commit'}.json"
+    )
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as salida_file:
+        json.dump({
+            'commit': commit,
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'semilla': args.semilla,
+            'iteraciones': args.iteraciones,
+            'resultados': resultados
+        }, salida_file, indent=2, ensure_ascii=False)
+    print(f"\n✅ Resultados guardados en {salida}\n")
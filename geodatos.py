@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Artefacto geográfico precalculado del dashboard.
+
+Los shapefiles se reproyectan una sola vez con preprocesamiento.py y el
+resultado (municipios, centroides, límites y puntos AIP) se guarda en archivos
+.npz que cada worker lee al arrancar, junto con el GeoJSON de cada nivel de
+detalle que se sirve al navegador. El artefacto se invalida cuando cambia la
+fecha de modificación o el tamaño de cualquier archivo fuente.
+
+Este módulo no depende de geopandas ni pyproj; shapely solo se importa si se
+consulta el índice espacial. Con la variable de entorno
+DASHBOARD_MODO_SERVICIO=1 los workers nunca reconstruyen el artefacto (ni
+importan esas librerías): debe generarse antes con preprocesamiento.py.
+"""
+
+import glob
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+shapefile_path = "data/shapefiles/municipio_distrito_y_area_no_municipalizada.shp"
+aip_locations_path = "data/shapefiles/cobertura_trabajo_aip.shp"
+geodatos_dir = "cache/geodatos"
+manifiesto_path = os.path.join(geodatos_dir, "manifiesto.json")
+version_formato = 5
+modo_servicio = os.environ.get('DASHBOARD_MODO_SERVICIO', '') == '1'
+
+# Pirámide de niveles de detalle del GeoJSON de municipios según el zoom del
+# mapa: a escala de país los bordes se simplifican y sus coordenadas se cuantizan
+niveles_detalle = [
+    {'nombre': 'pais', 'zoom_min': 0, 'tolerancia': 0.01, 'decimales': 3},
+    {'nombre': 'region', 'zoom_min': 6.5, 'tolerancia': 0.002, 'decimales': 4},
+    {'nombre': 'detalle', 'zoom_min': 9, 'tolerancia': 0, 'decimales': None}
+]
+
+def archivos_fuente():
+    archivos = []
+    for path in (shapefile_path, aip_locations_path):
+        archivos.extend(sorted(glob.glob(os.path.splitext(path)[0] + ".*")))
+    return archivos
+
+def firma_fuentes():
+    firma = {}
+    for path in archivos_fuente():
+        estado = os.stat(path)
+        firma[path] = [estado.st_mtime_ns, estado.st_size]
+    return firma
+
+def leer_manifiesto():
+    if not os.path.exists(manifiesto_path):
+        return None
+    with open(manifiesto_path, encoding='utf-8') as manifiesto_file:
+        return json.load(manifiesto_file)
+
+def artefacto_vigente():
+    manifiesto = leer_manifiesto()
+    if manifiesto is None:
+        return False
+    return manifiesto.get('formato') == version_formato and manifiesto.get('fuentes') == firma_fuentes()
+
+def ruta_geojson(nivel):
+    return os.path.join(geodatos_dir, f"municipios-{nivel}.geojson")
+
+def escribir_atomico(path, escribir):
+    # Se escribe en un temporal y se renombra, así varios workers pueden
+    # reconstruir el artefacto a la vez sin dejar archivos a medio escribir
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    raiz, extension = os.path.splitext(path)
+    temporal = f"{raiz}.{os.getpid()}.tmp{extension}"
+    escribir(temporal)
+    os.replace(temporal, path)
+
+def guardar_tabla(nombre, columnas):
+    arreglos = {
+        columna: np.asarray(valores, dtype=str) if np.asarray(valores).dtype == object else np.asarray(valores)
+        for columna, valores in columnas.items()
+    }
+    escribir_atomico(os.path.join(geodatos_dir, f"{nombre}.npz"), lambda path: np.savez(path, **arreglos))
+
+def leer_tabla(nombre):
+    with np.load(os.path.join(geodatos_dir, f"{nombre}.npz")) as datos:
+        return pd.DataFrame({columna: datos[columna] for columna in datos.files})
+
+def escribir_bytes(path, contenido):
+    def escribir(temporal):
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+    escribir_atomico(path, escribir)
+
+def guardar_manifiesto(firma, niveles):
+    contenido = json.dumps({'formato': version_formato, 'fuentes': firma, 'niveles': niveles}, indent=2)
+    escribir_bytes(manifiesto_path, contenido.encode('utf-8'))
+
+def cargar_geodatos():
+    if not artefacto_vigente():
+        if modo_servicio:
+            raise RuntimeError(
+                f"El artefacto geográfico en {geodatos_dir} no existe o está desactualizado. "
+                "Ejecute 'python preprocesamiento.py' antes de iniciar los workers."
+            )
+        # Solo se necesitan las librerías geoespaciales para reconstruirlo
+        import preprocesamiento
+        preprocesamiento.construir_artefacto()
+    return leer_tabla('municipios'), leer_tabla('aip'), leer_manifiesto()['niveles']
+
+# Índice espacial (STRtree) sobre los polígonos del GeoJSON de detalle. Se
+# construye la primera vez que se consulta; devuelve filas de la tabla de
+# municipios a partir del código DANE de cada polígono
+class IndiceEspacial:
+    def __init__(self, codigos, nivel='detalle'):
+        self.filas_por_codigo = {codigo: fila for fila, codigo in enumerate(codigos)}
+        self.nivel = nivel
+        self.lock = threading.Lock()
+        self.arbol = None
+        self.filas = None
+
+    def _construir(self):
+        import shapely
+        from shapely.geometry import shape
+        with open(ruta_geojson(self.nivel), encoding='utf-8') as geojson_file:
+            features = json.load(geojson_file)['features']
+        features = [f for f in features if f['geometry'] and str(f['id']) in self.filas_por_codigo]
+        self.filas = np.array([self.filas_por_codigo[str(f['id'])] for f in features], dtype=np.int32)
+        self.arbol = shapely.STRtree([shape(f['geometry']) for f in features])
+
+    def municipios_en(self, geometria):
+        with self.lock:
+            if self.arbol is None:
+                self._construir()
+        return np.unique(self.filas[self.arbol.query(geometria, predicate='intersects')])
+
+    def municipio_en(self, lon, lat):
+        from shapely.geometry import Point
+        filas = self.municipios_en(Point(lon, lat))
+        return int(filas[0]) if len(filas) else None
+
+    def municipios_en_caja(self, minx, miny, maxx, maxy):
+        from shapely.geometry import box
+        return self.municipios_en(box(minx, miny, maxx, maxy))
+
+    def municipios_en_poligono(self, puntos):
+        from shapely.geometry import Polygon
+        # buffer(0) corrige los lazos que se cruzan a sí mismos
+        return self.municipios_en(Polygon(puntos).buffer(0))
+
+# Índice de rejilla sobre puntos en coordenadas planas (metros). Los puntos se
+# ordenan por celda; una consulta por radio solo revisa las celdas que cubren
+# el círculo, con una búsqueda binaria por cada fila de celdas
+class IndiceRadio:
+    def __init__(self, x, y, celda=20000):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.celda = celda
+        validos = np.flatnonzero(np.isfinite(self.x) & np.isfinite(self.y))
+        self.x0 = self.x[validos].min() if len(validos) else 0.0
+        self.y0 = self.y[validos].min() if len(validos) else 0.0
+        columna = ((self.x[validos] - self.x0) // celda).astype(np.int64)
+        fila = ((self.y[validos] - self.y0) // celda).astype(np.int64)
+        self.columnas = int(columna.max()) + 1 if len(validos) else 0
+        self.filas = int(fila.max()) + 1 if len(validos) else 0
+        claves = fila * self.columnas + columna
+        orden = np.argsort(claves, kind='stable')
+        self.claves = claves[orden]
+        self.puntos = validos[orden]
+
+    def dentro(self, x, y, radio):
+        columna_min = max(int((x - radio - self.x0) // self.celda), 0)
+        columna_max = min(int((x + radio - self.x0) // self.celda), self.columnas - 1)
+        fila_min = max(int((y - radio - self.y0) // self.celda), 0)
+        fila_max = min(int((y + radio - self.y0) // self.celda), self.filas - 1)
+        if columna_min > columna_max or fila_min > fila_max:
+            return np.empty(0, dtype=np.int64)
+        
+        bases = np.arange(fila_min, fila_max + 1) * self.columnas
+        inicios = np.searchsorted(self.claves, bases + columna_min, side='left')
+        fines = np.searchsorted(self.claves, bases + columna_max, side='right')
+        candidatos = np.concatenate([self.puntos[i:j] for i, j in zip(inicios, fines)])
+        distancia2 = (self.x[candidatos] - x) ** 2 + (self.y[candidatos] - y) ** 2
+        return np.sort(candidatos[distancia2 <= radio ** 2])
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas de los callbacks del dashboard en formato de texto de Prometheus.
+
+Cada worker acumula en memoria, por callback, el número de llamadas (por input
+que las disparó), los errores y los histogramas de latencia y de bytes de la
+respuesta, además de las estadísticas de las cachés registradas. Con varios
+workers de gunicorn cada proceso vuelca su estado cada pocos segundos en un
+archivo JSON propio (metricas-<pid>-<inicio>.json) dentro de
+DASHBOARD_METRICAS_DIR; la ruta /metrics suma los archivos de todos los
+workers al responder. Los archivos de workers terminados se acumulan en
+terminados.json y se borran, así los contadores no retroceden entre
+reinicios ni despliegues.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+from geodatos import escribir_atomico
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+metricas_dir = os.environ.get('DASHBOARD_METRICAS_DIR', 'cache/metricas')
+intervalo_volcado = 5
+
+buckets_latencia = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+buckets_bytes = [1000, 10000, 100000, 500000, 1000000, 5000000, 10000000]
+
+def histograma_vacio(buckets):
+    return {'cuentas': [0] * (len(buckets) + 1), 'suma': 0, 'cuenta': 0}
+
+def observar(histograma, buckets, valor):
+    posicion = next((i for i, limite in enumerate(buckets) if valor <= limite), len(buckets))
+    histograma['cuentas'][posicion] += 1
+    histograma['suma'] += valor
+    histograma['cuenta'] += 1
+
+def sumar_histograma(destino, origen):
+    destino['cuentas'] = [a + b for a, b in zip(destino['cuentas'], origen['cuentas'])]
+    destino['suma'] += origen['suma']
+    destino['cuenta'] += origen['cuenta']
+
+def estado_vacio():
+    return {'pid': None, 'llamadas': {}, 'errores': {}, 'latencia': {}, 'bytes': {}, 'caches': {}}
+
+def sumar_estado(total, estado, vivo):
+    for callback, por_disparador in estado['llamadas'].items():
+        destino = total['llamadas'].setdefault(callback, {})
+        for disparador, cuenta in por_disparador.items():
+            destino[disparador] = destino.get(disparador, 0) + cuenta
+    for callback, cuenta in estado['errores'].items():
+        total['errores'][callback] = total['errores'].get(callback, 0) + cuenta
+    for clave, buckets in (('latencia', buckets_latencia), ('bytes', buckets_bytes)):
+        for callback, histograma in estado[clave].items():
+            sumar_histograma(total[clave].setdefault(callback, histograma_vacio(buckets)), histograma)
+    for nombre, estadisticas in estado['caches'].items():
+        destino = total['caches'].setdefault(nombre, {'aciertos': 0, 'fallos': 0, 'desalojos': 0, 'entradas': 0, 'bytes': 0})
+        for contador in ('aciertos', 'fallos', 'desalojos'):
+            destino[contador] += estadisticas[contador]
+        # El tamaño actual solo cuenta para los workers que siguen vivos
+        if vivo:
+            destino['entradas'] += estadisticas['entradas']
+            destino['bytes'] += estadisticas['bytes']
+
+def leer_estado(path):
+    try:
+        with open(path, encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return None
+
+def escribir_estado(path, estado):
+    contenido = json.dumps(estado).encode('utf-8')
+    def escribir(temporal):
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+    escribir_atomico(path, escribir)
+
+def proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def etiquetas(**valores):
+    return '{' + ','.join(f'{nombre}="{escapar(valor)}"' for nombre, valor in valores.items()) + '}'
+
+class Metricas:
+    def __init__(self, directorio=metricas_dir):
+        self.directorio = directorio
+        self.lock = threading.Lock()
+        self.lock_volcado = threading.Lock()
+        self.caches = {}
+        self.llamadas = {}
+        self.errores = {}
+        self.latencia = {}
+        self.bytes = {}
+        self.pendiente = False
+        self.hilo_volcado = None
+        self.archivo = None
+
+    def registrar_cache(self, nombre, cache):
+        self.caches[nombre] = cache
+
+    def registrar_llamada(self, callback, disparador, segundos, tamano, error=False):
+        with self.lock:
+            por_disparador = self.llamadas.setdefault(callback, {})
+            por_disparador[disparador] = por_disparador.get(disparador, 0) + 1
+            if error:
+                self.errores[callback] = self.errores.get(callback, 0) + 1
+            observar(self.latencia.setdefault(callback, histograma_vacio(buckets_latencia)), buckets_latencia, segundos)
+            observar(self.bytes.setdefault(callback, histograma_vacio(buckets_bytes)), buckets_bytes, tamano)
+            self.pendiente = True
+            # El hilo se inicia con la primera llamada, ya dentro del worker
+            if self.directorio and self.hilo_volcado is None:
+                self.hilo_volcado = threading.Thread(target=self._volcado_periodico, daemon=True)
+                self.hilo_volcado.start()
+
+    def _volcado_periodico(self):
+        while True:
+            time.sleep(intervalo_volcado)
+            if self.pendiente:
+                self.volcar()
+
+    def estado(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'llamadas': json.loads(json.dumps(self.llamadas)),
+                'errores': dict(self.errores),
+                'latencia': json.loads(json.dumps(self.latencia)),
+                'bytes': json.loads(json.dumps(self.bytes)),
+                'caches': {nombre: cache.estadisticas() for nombre, cache in self.caches.items()}
+            }
+
+    def ruta_worker(self):
+        # El nombre lleva el pid y el instante del primer volcado del proceso:
+        # un worker nuevo que reutilice el pid de uno terminado no pisa su archivo
+        pid = os.getpid()
+        if self.archivo is None or self.archivo[0] != pid:
+            self.archivo = (pid, os.path.join(self.directorio, f"metricas-{pid}-{time.time_ns():x}.json"))
+        return self.archivo[1]
+
+    def volcar(self):
+        if not self.directorio:
+            return
+        # El temporal lleva el pid: el hilo periódico y /metrics no deben escribirlo a la vez
+        with self.lock_volcado:
+            self.pendiente = False
+            escribir_estado(self.ruta_worker(), self.estado())
+
+    def consolidar_terminados(self, paths):
+        # Suma a terminados.json los archivos de workers que ya no existen y los
+        # borra. 'archivos' guarda los ya sumados por si se interrumpe antes de
+        # borrarlos; se depura con los que ya no están en el directorio.
+        ruta = os.path.join(self.directorio, "terminados.json")
+        terminados = leer_estado(ruta) or {**estado_vacio(), 'archivos': []}
+        nombres = {os.path.basename(path): path for path in paths}
+        sumados = len(terminados['archivos'])
+        terminados['archivos'] = [nombre for nombre in terminados['archivos'] if nombre in nombres]
+        vivos, cambios = [], len(terminados['archivos']) != sumados
+        for nombre, path in nombres.items():
+            if nombre in terminados['archivos']:
+                continue
+            estado = leer_estado(path)
+            if estado is None:
+                continue
+            if estado['pid'] == os.getpid() or proceso_vivo(estado['pid']):
+                vivos.append(estado)
+                continue
+            sumar_estado(terminados, estado, vivo=False)
+            terminados['archivos'].append(nombre)
+            cambios = True
+        if cambios:
+            escribir_estado(ruta, terminados)
+        for nombre in terminados['archivos']:
+            try:
+                os.remove(nombres[nombre])
+            except OSError:
+                pass
+        return [terminados] + vivos
+
+    def estados_workers(self):
+        # El worker que atiende /metrics vuelca su estado antes de leer los de
+        # los demás. La lectura y la consolidación van bajo un cerrojo de
+        # archivo para que dos workers no sumen dos veces el mismo archivo.
+        if not self.directorio:
+            return [self.estado()]
+        self.volcar()
+        if fcntl is None:
+            return [estado for estado in map(leer_estado, self.archivos_workers()) if estado is not None]
+        with open(os.path.join(self.directorio, "terminados.lock"), 'a') as cerrojo:
+            fcntl.flock(cerrojo, fcntl.LOCK_EX)
+            return self.consolidar_terminados(self.archivos_workers())
+
+    def archivos_workers(self):
+        # Sin los temporales de escribir_atomico (metricas-<pid>-<inicio>.<pid>.tmp.json)
+        return [path for path in glob.glob(os.path.join(self.directorio, "metricas-*.json"))
+                if not path.endswith('.tmp.json')]
+
+    def agregar(self):
+        total = estado_vacio()
+        for estado in self.estados_workers():
+            vivo = estado['pid'] is not None and (estado['pid'] == os.getpid() or proceso_vivo(estado['pid']))
+            sumar_estado(total, estado, vivo)
+        return total
+
+    def texto_prometheus(self):
+        total = self.agregar()
+        lineas = []
+
+        def encabezado(nombre, tipo, ayuda):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+
+        def histograma(nombre, buckets, datos):
+            for callback, valores in sorted(datos.items()):
+                acumulado = 0
+                for limite, cuenta in zip(buckets + ['+Inf'], valores['cuentas']):
+                    acumulado += cuenta
+                    lineas.append(f"{nombre}_bucket{etiquetas(callback=callback, le=limite)} {acumulado}")
+                lineas.append(f"{nombre}_sum{etiquetas(callback=callback)} {valores['suma']}")
+                lineas.append(f"{nombre}_count{etiquetas(callback=callback)} {valores['cuenta']}")
+
+        encabezado('dashboard_callback_llamadas_total', 'counter', 'Llamadas a cada callback por input que las disparó.')
+        for callback, por_disparador in sorted(total['llamadas'].items()):
+            for disparador, cuenta in sorted(por_disparador.items()):
+                lineas.append(f"dashboard_callback_llamadas_total{etiquetas(callback=callback, disparador=disparador)} {cuenta}")
+
+        encabezado('dashboard_callback_errores_total', 'counter', 'Respuestas con error (5xx) de cada callback.')
+        for callback, cuenta in sorted(total['errores'].items()):
+            lineas.append(f"dashboard_callback_errores_total{etiquetas(callback=callback)} {cuenta}")
+
+        encabezado('dashboard_callback_latencia_segundos', 'histogram', 'Latencia de cada callback en el servidor.')
+        histograma('dashboard_callback_latencia_segundos', buckets_latencia, total['latencia'])
+
+        encabezado('dashboard_callback_respuesta_bytes', 'histogram', 'Tamaño de la respuesta serializada de cada callback.')
+        histograma('dashboard_callback_respuesta_bytes', buckets_bytes, total['bytes'])
+
+        for contador, ayuda in (('aciertos', 'Aciertos'), ('fallos', 'Fallos'), ('desalojos', 'Entradas desalojadas')):
+            encabezado(f'dashboard_cache_{contador}_total', 'counter', f'{ayuda} de cada caché en el servidor.')
+            for nombre, estadisticas in sorted(total['caches'].items()):
+                lineas.append(f"dashboard_cache_{contador}_total{etiquetas(cache=nombre)} {estadisticas[contador]}")
+
+        encabezado('dashboard_cache_tasa_aciertos', 'gauge', 'Aciertos sobre consultas de cada caché desde el arranque.')
+        for nombre, estadisticas in sorted(total['caches'].items()):
+            consultas = estadisticas['aciertos'] + estadisticas['fallos']
+            tasa = estadisticas['aciertos'] / consultas if consultas else 0
+            lineas.append(f"dashboard_cache_tasa_aciertos{etiquetas(cache=nombre)} {tasa:.6f}")
+
+        for medida, ayuda in (('entradas', 'Entradas'), ('bytes', 'Bytes estimados')):
+            encabezado(f'dashboard_cache_{medida}', 'gauge', f'{ayuda} en cada caché de los workers activos.')
+            for nombre, estadisticas in sorted(total['caches'].items()):
+                lineas.append(f"dashboard_cache_{medida}{etiquetas(cache=nombre)} {estadisticas[medida]}")
+
+        return '\n'.join(lineas) + '\n'
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Preprocesamiento de los shapefiles del dashboard.
+
+Reproyecta los municipios y las ubicaciones AIP, calcula centroides y límites,
+genera el GeoJSON de cada nivel de detalle y guarda el artefacto que leen los
+workers (ver geodatos.py). Es el único punto que requiere geopandas, shapely y
+pyproj. Se ejecuta automáticamente cuando el artefacto no está vigente (salvo
+en modo servicio), o a mano con:
+
+    python preprocesamiento.py
+"""
+
+import hashlib
+import geopandas as gpd
+import shapely
+import geodatos
+
+def construir_geojson_municipios(gdf, tolerancia=0, decimales=None):
+    gdf = gdf.set_index('MpCodigo')[['MpNombre', 'Depto', 'geometry']]
+    if tolerancia:
+        gdf = gdf.set_geometry(gdf.geometry.simplify(tolerancia, preserve_topology=True))
+    if decimales is not None:
+        gdf = gdf.set_geometry(shapely.set_precision(gdf.geometry.to_numpy(), 10 ** -decimales))
+    return gdf.to_json(drop_id=False).encode('utf-8')
+
+def construir_artefacto():
+    firma = geodatos.firma_fuentes()
+    
+    municipios_gdf = gpd.read_file(geodatos.shapefile_path)
+    aip_locations_gdf = gpd.read_file(geodatos.aip_locations_path)
+    
+    if municipios_gdf.crs != "EPSG:4326":
+        municipios_gdf = municipios_gdf.to_crs("EPSG:4326")
+    if aip_locations_gdf.crs != "EPSG:4326":
+        aip_locations_gdf = aip_locations_gdf.to_crs("EPSG:4326")
+    
+    # Código DANE como identificador estable y nombres normalizados para
+    # coincidir con la base de proyectos
+    municipios_gdf['MpCodigo'] = municipios_gdf['MpCodigo'].astype(str).str.strip()
+    municipios_gdf['MpNombre'] = municipios_gdf['MpNombre'].str.upper().str.strip()
+    municipios_gdf['Depto'] = municipios_gdf['Depto'].str.upper().str.strip()
+    
+    # Centroides y extensión calculados en coordenadas planas (EPSG:3116, metros)
+    municipios_planos = municipios_gdf.to_crs("EPSG:3116").geometry
+    centroides = municipios_planos.centroid
+    centroides_geo = centroides.to_crs("EPSG:4326")
+    limites = municipios_gdf.geometry.bounds
+    limites_planos = municipios_planos.bounds
+    
+    geodatos.guardar_tabla('municipios', {
+        'MpCodigo': municipios_gdf['MpCodigo'],
+        'MpNombre': municipios_gdf['MpNombre'],
+        'Depto': municipios_gdf['Depto'],
+        'lon': centroides_geo.x,
+        'lat': centroides_geo.y,
+        'x': centroides.x,
+        'y': centroides.y,
+        'minx': limites['minx'],
+        'miny': limites['miny'],
+        'maxx': limites['maxx'],
+        'maxy': limites['maxy'],
+        'ancho_m': limites_planos['maxx'] - limites_planos['minx'],
+        'alto_m': limites_planos['maxy'] - limites_planos['miny']
+    })
+    
+    # Municipio que contiene cada punto AIP (fila de la tabla de municipios o -1),
+    # resuelto con un join espacial sobre el STRtree de geopandas
+    union = gpd.sjoin(
+        aip_locations_gdf[['geometry']],
+        municipios_gdf[['geometry']].reset_index(drop=True),
+        how='left',
+        predicate='within'
+    )
+    union = union[~union.index.duplicated(keep='first')]
+    aip_municipio = union['index_right'].fillna(-1).astype('int32')
+    
+    aip_planos = aip_locations_gdf.to_crs("EPSG:3116").geometry
+    geodatos.guardar_tabla('aip', {
+        'lon': aip_locations_gdf.geometry.x,
+        'lat': aip_locations_gdf.geometry.y,
+        'x': aip_planos.x,
+        'y': aip_planos.y,
+        'Municipio': aip_locations_gdf['Municipio'],
+        'Departamen': aip_locations_gdf['Departamen'],
+        'municipio_id': aip_municipio.reindex(aip_locations_gdf.index).to_numpy()
+    })
+    
+    niveles = {}
+    for nivel in geodatos.niveles_detalle:
+        contenido = construir_geojson_municipios(municipios_gdf, nivel['tolerancia'], nivel['decimales'])
+        geodatos.escribir_bytes(geodatos.ruta_geojson(nivel['nombre']), contenido)
+        niveles[nivel['nombre']] = hashlib.sha1(contenido).hexdigest()
+    
+    geodatos.guardar_manifiesto(firma, niveles)
+
+if __name__ == '__main__':
+    construir_artefacto()
+    print(f"\n✅ Artefacto geográfico generado en {geodatos.geodatos_dir}\n")